@@ -0,0 +1,91 @@
+"""답변 캐시 — 같은/거의 같은 질문이 같은 문서를 검색하면 llama-server 호출 생략
+키: 정규화 질문 + 게임 + 컨텍스트 chunk id들
+인덱스(ingest.py 재실행)가 바뀌면 chunk id가 달라지므로 서버 재시작 필요 — 캐시는 프로세스 메모리라 재시작 시 비워짐
+조회: 정확 키 → 없으면 같은 (게임, chunk ids) 그룹 안에서 질문 임베딩 코사인 유사도 ≥ 임계값"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))    # 초
+ANSWER_CACHE_SIM = float(os.getenv("ANSWER_CACHE_SIM", "0.93"))    # 근사 매칭 코사인 임계값
+
+
+def normalize_query(query):
+    """소문자 + 공백 정리 + 끝 문장부호 제거 ("한조 궁극기?" == "한조  궁극기")"""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?？!.~ ")
+
+
+class AnswerCache:
+    """TTL + LRU 크기 제한 답변 캐시 (스레드 안전)"""
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_SIM):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key → {"answer", "sources", "vector", "expires"}
+        self._groups = {}  # (game, chunk ids) → {key, ...} — 근사 매칭 후보
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        group = self._groups.get(key[1:])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._groups[key[1:]]
+
+    def get(self, query, game, chunk_ids, vector):
+        """캐시된 {"answer", "sources"} 또는 None"""
+        key = (normalize_query(query), game or "", tuple(chunk_ids))
+        now = time.time()
+        with self._lock:
+            candidates = [key] if key in self._entries else []
+            if not candidates and vector is not None:
+                q = np.asarray(vector, dtype=np.float32)
+                q = q / (np.linalg.norm(q) or 1.0)
+                best, best_sim = None, self.threshold
+                for other in self._groups.get(key[1:], ()):
+                    sim = float(q @ self._entries[other]["vector"])
+                    if sim >= best_sim:
+                        best, best_sim = other, sim
+                if best is not None:
+                    candidates = [best]
+            for k in candidates:
+                entry = self._entries[k]
+                if entry["expires"] < now:
+                    self._remove(k)
+                    continue
+                self._entries.move_to_end(k)
+                self.hits += 1
+                return {"answer": entry["answer"], "sources": list(entry["sources"])}
+            self.misses += 1
+            return None
+
+    def put(self, query, game, chunk_ids, vector, answer, sources):
+        key = (normalize_query(query), game or "", tuple(chunk_ids))
+        v = np.asarray(vector, dtype=np.float32)
+        v = v / (np.linalg.norm(v) or 1.0)
+        with self._lock:
+            self._entries[key] = {"answer": answer, "sources": list(sources), "vector": v,
+                                  "expires": time.time() + self.ttl}
+            self._entries.move_to_end(key)
+            self._groups.setdefault(key[1:], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        """{"size", "hits", "misses", "hit_rate"}"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
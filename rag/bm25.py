@@ -0,0 +1,171 @@
+"""BM25 검색 — 역색인(postings) 기반, rank_bm25.BM25Okapi와 동일한 점수/순위
+get_scores()처럼 전체 문서를 훑지 않고, 질의 토큰이 들어있는 문서만 NumPy로 누적"""
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import numpy as np
+
+# 디스크 포맷 버전 — 배열 구성이나 tokenize_ko가 바뀌면 올릴 것 (기존 파일은 stale 처리 → 재구축)
+FORMAT_VERSION = 1
+_ARRAYS = ("indptr", "doc_ids", "tfs", "doc_len", "idf")
+
+
+def tokenize_ko(text):
+    """한국어 토크나이저 — 공백 분리 + 슬라이딩 바이그램으로 붙어쓰기 대응"""
+    text = text.lower()
+    raw_tokens = re.findall(r'[가-힣a-zA-Z0-9]+', text)
+    tokens = []
+    for t in raw_tokens:
+        if len(t) <= 5:
+            if len(t) >= 2:
+                tokens.append(t)
+        else:
+            tokens.append(t)
+            for i in range(len(t) - 1):
+                tokens.append(t[i:i+2])
+                if i + 3 <= len(t):
+                    tokens.append(t[i:i+3])
+    return tokens if tokens else raw_tokens
+
+
+def corpus_fingerprint(doc_ids):
+    """docstore id 순서 해시 — FAISS 인덱스가 다시 만들어지면 값이 바뀌어 BM25도 재구축"""
+    h = hashlib.sha1()
+    for doc_id in doc_ids:
+        h.update(str(doc_id).encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class BM25Index:
+    """CSR 형태 역색인
+    - vocab: {토큰: term id}
+    - indptr[t]:indptr[t+1] 구간 = term t의 postings (doc_ids 오름차순, tfs)
+    - doc_len, idf: BM25Okapi와 같은 정의 (idf 음수는 epsilon * 평균 idf로 대체)"""
+
+    def __init__(self, vocab, indptr, doc_ids, tfs, doc_len, idf, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+        self.corpus_size = len(doc_len)
+        self.avgdl = int(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0
+        # 문서 길이 정규화 항은 질의와 무관 → 한 번만 계산
+        self._norm = k1 * (1 - b + b * doc_len / self.avgdl) if self.corpus_size else np.zeros(0)
+
+    @classmethod
+    def build(cls, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        """토큰화된 corpus([[token, ...], ...])로 인덱스 생성"""
+        vocab = {}
+        post_docs = []  # term id → [doc id, ...]
+        post_tfs = []   # term id → [tf, ...]
+        doc_len = np.zeros(len(corpus), dtype=np.int32)
+        for d, document in enumerate(corpus):
+            doc_len[d] = len(document)
+            frequencies = {}
+            for word in document:
+                frequencies[word] = frequencies.get(word, 0) + 1
+            for word, freq in frequencies.items():
+                tid = vocab.get(word)
+                if tid is None:
+                    tid = vocab[word] = len(post_docs)
+                    post_docs.append([])
+                    post_tfs.append([])
+                post_docs[tid].append(d)
+                post_tfs[tid].append(freq)
+
+        lengths = np.fromiter((len(p) for p in post_docs), dtype=np.int64, count=len(post_docs))
+        indptr = np.zeros(len(post_docs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        doc_ids = np.fromiter((d for p in post_docs for d in p), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((f for p in post_tfs for f in p), dtype=np.int32, count=int(indptr[-1]))
+
+        # idf — BM25Okapi._calc_idf와 같은 순서/연산 (평균 idf 부동소수 오차까지 동일하게)
+        n = len(corpus)
+        idf = np.zeros(len(post_docs), dtype=np.float64)
+        idf_sum = 0
+        negative = []
+        for tid, freq in enumerate(lengths.tolist()):
+            value = math.log(n - freq + 0.5) - math.log(freq + 0.5)
+            idf[tid] = value
+            idf_sum += value
+            if value < 0:
+                negative.append(tid)
+        if len(idf):
+            idf[negative] = epsilon * (idf_sum / len(idf))
+        return cls(vocab, indptr, doc_ids, tfs, doc_len, idf, k1=k1, b=b)
+
+    def _accumulate(self, tokens):
+        """질의 토큰이 등장하는 문서만 점수 누적 → (후보 doc ids 오름차순, 점수)"""
+        terms = [tid for tid in (self.vocab.get(t) for t in tokens) if tid is not None]
+        if not terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        cand = np.unique(np.concatenate([self.doc_ids[self.indptr[t]:self.indptr[t + 1]] for t in set(terms)]))
+        scores = np.zeros(len(cand))
+        # 중복 토큰도 BM25Okapi처럼 등장 횟수만큼 더함
+        for t in terms:
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            docs = self.doc_ids[lo:hi]
+            tf = self.tfs[lo:hi]
+            pos = np.searchsorted(cand, docs)
+            scores[pos] += self.idf[t] * (tf * (self.k1 + 1) / (tf + self._norm[docs]))
+        return cand, scores
+
+    def get_scores(self, tokens):
+        """전체 문서 점수 배열 (BM25Okapi.get_scores 호환, 디버깅용)"""
+        full = np.zeros(self.corpus_size)
+        cand, scores = self._accumulate(tokens)
+        full[cand] = scores
+        return full
+
+    def top_k(self, tokens, k):
+        """점수 > 0 인 상위 k개 [(doc id, score), ...]
+        순위는 sorted(get_scores, reverse=True)와 동일 (동점이면 doc id 작은 쪽 먼저)"""
+        cand, scores = self._accumulate(tokens)
+        keep = scores > 0
+        cand, scores = cand[keep], scores[keep]
+        if len(scores) > k:
+            kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+            keep = scores >= kth  # 경계 동점은 전부 남긴 뒤 아래 정렬에서 자름
+            cand, scores = cand[keep], scores[keep]
+        order = np.lexsort((cand, -scores))[:k]
+        return [(int(cand[i]), float(scores[i])) for i in order]
+
+    def save(self, path, fingerprint):
+        """배열별 .npy + vocab.json + meta.json 디렉토리로 저장 (임시 디렉토리에 쓴 뒤 교체)"""
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp, name + ".npy"), np.asarray(getattr(self, name)))
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(tmp, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        meta = {"version": FORMAT_VERSION, "fingerprint": fingerprint,
+                "corpus_size": self.corpus_size, "k1": self.k1, "b": self.b}
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """저장된 인덱스를 mmap으로 로드 — 없거나 버전/fingerprint가 다르면 None (호출 측에서 재구축)"""
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != FORMAT_VERSION or meta.get("fingerprint") != fingerprint:
+                return None
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in _ARRAYS}
+            with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+                vocab = {term: i for i, term in enumerate(json.load(f))}
+        except (OSError, ValueError):
+            return None
+        return cls(vocab, k1=meta["k1"], b=meta["b"], **arrays)
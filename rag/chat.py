@@ -1,8 +1,8 @@
 """나무위키 RAG 챗봇 — 로컬 llama-server 연동"""
 import os
-import requests
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
+import llm_client
 
 DB_DIR = os.path.join(os.path.dirname(__file__), "faiss_db")
 LLAMA_URL = "http://localhost:8090/v1/chat/completions"
@@ -42,9 +42,7 @@ def ask_llm(query, context):
         "repeat_penalty": 1.3,
     }
     try:
-        resp = requests.post(LLAMA_URL, json=payload, timeout=60)
-        resp.raise_for_status()
-        return resp.json()["choices"][0]["message"]["content"]
+        return llm_client.complete(LLAMA_URL, payload, timeout=60)["choices"][0]["message"]["content"]
     except Exception as e:
         return f"❌ LLM 연결 실패: {e}"
 
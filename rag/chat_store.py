@@ -0,0 +1,137 @@
+"""채팅 저장소 (chat.db) — 스레드별 커넥션 재사용 + WAL + 인덱스
+HTTP 워커/세션 플러셔 스레드마다 커넥션 1개를 열어 계속 사용 (요청마다 connect/close X)
+쓰기는 `with conn:` 트랜잭션 (예외 시 롤백 — 재사용 커넥션에 열린 트랜잭션이 남지 않도록)"""
+import os
+import sqlite3
+import threading
+
+CHAT_DB = os.path.join(os.path.dirname(__file__), "chat.db")
+CHAT_DB_CACHE_KB = int(os.getenv("CHAT_DB_CACHE_KB", "8192"))  # 커넥션당 페이지 캐시 (KB)
+BUSY_TIMEOUT = 10  # 다른 스레드가 쓰는 중일 때 잠금 대기 (초)
+
+_local = threading.local()
+
+
+def get_conn():
+    """현재 스레드 전용 커넥션 (없으면 열고 pragma 설정)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CHAT_DB, timeout=BUSY_TIMEOUT)
+        # WAL에서는 NORMAL이면 커밋마다 fsync하지 않음 (체크포인트 때만) — 전원 장애 시 마지막 몇 건만 유실 가능
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CHAT_DB_CACHE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+    return conn
+
+
+def init_db():
+    conn = get_conn()
+    conn.execute("PRAGMA journal_mode=WAL")  # DB 파일에 저장되는 설정 — 읽기가 쓰기를 기다리지 않음
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            created_at REAL,
+            updated_at REAL
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT,
+            content TEXT,
+            sources TEXT,
+            created_at REAL,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )""")
+        # 세션 메시지 조회(load_from_db, /messages 페이지)와 세션 목록 정렬/커서 페이지용
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_recent ON sessions(updated_at, id)")
+
+
+# ── 조회 ──
+def list_sessions(limit=None, before=None):
+    """최근 대화 순 [{"id", "title", "created_at", "updated_at"}, ...]
+    limit: 최대 개수 (None이면 전부), before: (updated_at, id) 커서 — 그보다 뒤(오래된) 세션만"""
+    sql = "SELECT id, title, created_at, updated_at FROM sessions"
+    args = []
+    if before is not None:
+        sql += " WHERE (updated_at, id) < (?, ?)"
+        args += before
+    sql += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+    rows = get_conn().execute(sql, args + [-1 if limit is None else limit]).fetchall()
+    return [{"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3]} for r in rows]
+
+
+def get_messages(sid, limit=None, before=None):
+    """[(role, content, sources JSON, created_at, id), ...] — 시간순 (같은 시각이면 id순)
+    limit: 최근 N개만, before: (created_at, id) 커서 — 그보다 이전 메시지만 (위로 스크롤해서 더 불러오기)"""
+    sql = "SELECT role, content, sources, created_at, id FROM messages WHERE session_id=?"
+    args = [sid]
+    if before is not None:
+        sql += " AND (created_at, id) < (?, ?)"
+        args += before
+    if limit is None:
+        return get_conn().execute(sql + " ORDER BY created_at, id", args).fetchall()
+    rows = get_conn().execute(sql + " ORDER BY created_at DESC, id DESC LIMIT ?", args + [limit]).fetchall()
+    return rows[::-1]
+
+
+def get_title(sid):
+    row = get_conn().execute("SELECT title FROM sessions WHERE id=?", (sid,)).fetchone()
+    return row[0] if row else None
+
+
+# ── 쓰기 ──
+def create_session(sid, title, now, max_sessions=10):
+    """새 세션 생성 — 이미 max_sessions개면 가장 오래된 세션 삭제 (FIFO)
+    Returns: 삭제된 세션 id 또는 None"""
+    conn = get_conn()
+    evicted = None
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")  # 개수 확인~삽입 사이에 다른 워커가 끼어들지 않도록 쓰기 잠금부터
+        count = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        if count >= max_sessions:
+            oldest = conn.execute("SELECT id FROM sessions ORDER BY created_at ASC LIMIT 1").fetchone()
+            if oldest:
+                evicted = oldest[0]
+                conn.execute("DELETE FROM messages WHERE session_id=?", (evicted,))
+                conn.execute("DELETE FROM sessions WHERE id=?", (evicted,))
+        conn.execute("INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?,?,?,?)",
+                     (sid, title, now, now))
+    return evicted
+
+
+def clear_session(sid, notice, now):
+    """메시지를 안내 문구 하나로 교체"""
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM messages WHERE session_id=?", (sid,))
+        conn.execute("INSERT INTO messages (session_id, role, content, sources, created_at) VALUES (?,?,?,?,?)",
+                     (sid, "system", notice, None, now))
+        conn.execute("UPDATE sessions SET updated_at=? WHERE id=?", (now, sid))
+
+
+def delete_session(sid):
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM messages WHERE session_id=?", (sid,))
+        conn.execute("DELETE FROM sessions WHERE id=?", (sid,))
+
+
+def write_sessions(snapshot):
+    """세션 캐시 flush 스냅샷을 한 트랜잭션으로 저장
+    snapshot: [(sid, title, created_at, updated_at(마지막 대화 시각), 새 메시지 행 [(role, content, sources JSON, created_at), ...], replace, trimmed, 남길 메시지 수), ...]
+    세션 upsert, 새 메시지 INSERT, replace면 기존 메시지 전부 삭제 후, trimmed면 최근 N개보다 오래된 행을 id 범위 삭제"""
+    conn = get_conn()
+    with conn:
+        conn.executemany("DELETE FROM messages WHERE session_id=?",
+                         [(sid,) for sid, _, _, _, _, replace, _, _ in snapshot if replace])
+        conn.executemany("""INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?,?,?,?)
+                            ON CONFLICT(id) DO UPDATE SET updated_at=MAX(updated_at, excluded.updated_at), title=excluded.title""",
+                         [(sid, title, created, updated) for sid, title, created, updated, *_ in snapshot])
+        conn.executemany("INSERT INTO messages (session_id, role, content, sources, created_at) VALUES (?,?,?,?,?)",
+                         [(sid, *row) for sid, _, _, _, new, _, _, _ in snapshot for row in new])
+        conn.executemany("""DELETE FROM messages WHERE session_id=? AND id <= (
+                                SELECT id FROM messages WHERE session_id=? ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                         [(sid, sid, keep) for sid, _, _, _, _, replace, trimmed, keep in snapshot if trimmed and not replace])
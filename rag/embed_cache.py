@@ -0,0 +1,75 @@
+"""쿼리 임베딩 LRU 캐시 — 같은 질문 반복(QA cron, 재검색 경로) 시 ko-sroberta forward pass 생략"""
+import os
+import threading
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings 래퍼 — embed_query 결과를 쿼리 문자열 키로 LRU 캐시
+    FAISS.load_local()에 그대로 넘기면 similarity_search가 캐시를 거침
+    embed_documents(인덱싱용)는 캐시하지 않음"""
+
+    def __init__(self, base, max_size=EMBED_CACHE_SIZE):
+        self.base = base
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # {query: vector}
+        self.hits = 0
+        self.misses = 0
+
+    def embed_query(self, text):
+        with self._lock:
+            vec = self._cache.get(text)
+            if vec is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return vec
+            self.misses += 1
+        # forward pass는 락 밖에서 (다른 워커의 캐시 조회를 막지 않도록)
+        vec = self.base.embed_query(text)
+        with self._lock:
+            self._cache[text] = vec
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vec
+
+    def embed_queries(self, texts):
+        """여러 쿼리 임베딩 — 캐시 miss만 모아 한 번의 배치 forward pass
+        (HuggingFaceEmbeddings.embed_query는 embed_documents([text])[0]과 같은 벡터)"""
+        with self._lock:
+            vecs = [self._cache.get(t) for t in texts]
+            for t, v in zip(texts, vecs):
+                if v is not None:
+                    self._cache.move_to_end(t)
+            n_miss = sum(1 for v in vecs if v is None)
+            self.hits += len(texts) - n_miss
+            self.misses += n_miss
+            missing = list(dict.fromkeys(t for t, v in zip(texts, vecs) if v is None))
+        if missing:
+            fresh = dict(zip(missing, self.base.embed_documents(missing)))
+            with self._lock:
+                for t, v in fresh.items():
+                    self._cache[t] = v
+                    self._cache.move_to_end(t)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+            vecs = [v if v is not None else fresh[t] for t, v in zip(texts, vecs)]
+        return vecs
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def stats(self):
+        """{"size", "hits", "misses", "hit_rate"}"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -1,10 +1,14 @@
 """나무위키 크롤링 데이터를 FAISS 벡터DB에 저장"""
 import os
 import glob
+import json
+import shutil
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from bm25 import BM25Index, tokenize_ko, corpus_fingerprint
+from retrieval import PARTITION_META
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "crawler", "data")
 DB_DIR = os.path.join(os.path.dirname(__file__), "faiss_db")
@@ -21,6 +25,22 @@ def collect_files():
     return files
 
 
+def save_index(path, chunks, vectors, embeddings):
+    """FAISS 인덱스 + 같은 문서 순서의 BM25 인덱스 저장 (서버 시작 시 재토큰화 생략)
+    Returns: corpus_fingerprint (파티션 소속 표시용)"""
+    db = FAISS.from_embeddings(
+        list(zip([c.page_content for c in chunks], vectors)),
+        embeddings,
+        metadatas=[c.metadata for c in chunks],
+    )
+    db.save_local(path)
+    bm25_docs = list(db.docstore._dict.values())
+    bm25 = BM25Index.build([tokenize_ko(doc.page_content) for doc in bm25_docs])
+    fingerprint = corpus_fingerprint(db.docstore._dict.keys())
+    bm25.save(os.path.join(path, "bm25"), fingerprint)
+    return fingerprint
+
+
 def main():
     print("📂 나무위키 데이터 수집 중...")
     files = collect_files()
@@ -51,16 +71,39 @@ def main():
         separators=["\n\n", "\n", ". ", " "]
     )
     chunks = splitter.split_documents(docs)
+    # 전역 chunk id — 전체 인덱스와 게임별 파티션이 같은 id 공유 (서버는 RRF/중복 제거를 이 int로 처리)
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["chunk_id"] = i
     print(f"  → {len(chunks)}개 청크로 분할")
 
     print("🧠 임베딩 생성 중... (첫 실행 시 모델 다운로드)")
     embeddings = HuggingFaceEmbeddings(model_name="jhgan/ko-sroberta-multitask")
+    # 임베딩은 한 번만 계산 → 전체 인덱스와 게임별 인덱스가 같은 벡터 공유
+    vectors = embeddings.embed_documents([c.page_content for c in chunks])
 
-    db = FAISS.from_documents(chunks, embeddings)
-    db.save_local(DB_DIR)
+    parent = save_index(DB_DIR, chunks, vectors, embeddings)
     print(f"✅ FAISS DB 저장 완료! ({DB_DIR})")
     print(f"   총 {len(chunks)}개 청크 인덱싱")
 
+    # 게임별 파티션 (faiss_db/<game>/) — 게임이 감지된 질문은 해당 파티션만 검색
+    games = sorted({c.metadata["game"] for c in chunks})
+    for game in games:
+        idx = [i for i, c in enumerate(chunks) if c.metadata["game"] == game]
+        path = os.path.join(DB_DIR, game)
+        save_index(path, [chunks[i] for i in idx], [vectors[i] for i in idx], embeddings)
+        # 파티션 chunk_id는 이번 전체 인덱스 기준 — 서버는 parent가 다르면 이 파티션을 쓰지 않음
+        with open(os.path.join(path, PARTITION_META), "w", encoding="utf-8") as f:
+            json.dump({"game": game, "parent": parent}, f)
+        print(f"   └ {game}: {len(idx)}개 청크")
+    # 이전 ingest에서 남은 파티션 (지금은 없는 게임) 삭제
+    for name in sorted(os.listdir(DB_DIR)):
+        path = os.path.join(DB_DIR, name)
+        if name not in games and os.path.isfile(os.path.join(path, "index.faiss")):
+            shutil.rmtree(path)
+            print(f"   🗑️ 이전 파티션 삭제: {name}")
+    print(f"✅ 게임별 파티션 저장 완료 ({len(games)}개)")
+    print("   ⚠️ 실행 중인 web.py는 재시작해야 새 인덱스를 사용합니다 (인덱스는 시작 시 1회 로드)")
+
 
 if __name__ == "__main__":
     main()
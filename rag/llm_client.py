@@ -0,0 +1,70 @@
+"""llama-server HTTP 클라이언트 — 커넥션 풀 공유 + keep-alive + 연결 오류만 재시도"""
+import os
+import sys
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = int(os.getenv("LLAMA_POOL_SIZE", "8"))      # 호스트당 유지할 keep-alive 연결 수
+MAX_RETRIES = int(os.getenv("LLAMA_MAX_RETRIES", "2"))  # 연결 오류 재시도 횟수
+RETRY_BACKOFF = 0.5   # 첫 재시도 대기 (초), 이후 2배씩
+CONNECT_TIMEOUT = 3   # TCP 연결 타임아웃 (초) — 응답 대기 timeout과 별도
+# llama-server 슬롯 수 (-np 값과 맞출 것) — 0이면 슬롯 지정 없이 서버가 배정
+SLOTS = int(os.getenv("LLAMA_SLOTS", "0"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """프로세스 공용 requests.Session (웹 서버 워커 스레드들이 같은 풀을 공유)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # 재시도는 아래 post()에서 직접 처리 (urllib3 자동 재시도 X)
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def post(url, payload, timeout, stream=False):
+    """JSON POST — 연결 실패(서버 재시작, 끊긴 keep-alive 등)만 백오프 재시도
+    응답 대기 타임아웃(ReadTimeout)은 LLM이 이미 생성 중일 수 있으므로 재시도하지 않음"""
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, timeout), stream=stream)
+        except requests.ConnectionError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = RETRY_BACKOFF * (2 ** attempt)
+            print(f"[LLM] 연결 실패, {delay:.1f}초 후 재시도 ({attempt + 1}/{MAX_RETRIES}): {e}", file=sys.stderr, flush=True)
+            time.sleep(delay)
+
+
+def complete(url, payload, timeout):
+    """논스트리밍 호출 — 응답 JSON 반환 (HTTP 오류는 예외)"""
+    resp = post(url, payload, timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def token_counts(result):
+    """/completion 응답(또는 스트리밍 마지막 청크)의 토큰 수 → {"prompt", "completion", "cached"} (없는 값은 생략)"""
+    counts = {"prompt": result.get("tokens_evaluated"), "completion": result.get("tokens_predicted"),
+              "cached": result.get("tokens_cached")}
+    return {k: v for k, v in counts.items() if v is not None}
+
+
+def cache_params(slot=None):
+    """/completion 프롬프트 캐시 파라미터 — cache_prompt + 슬롯 지정
+    slot: LLMScheduler가 배정한 슬롯 (같은 세션은 직전 슬롯 우선 → 이전 대화까지 포함한 앞부분 KV 캐시 재사용)"""
+    params = {"cache_prompt": True}
+    if slot is not None and 0 <= slot < SLOTS:
+        params["id_slot"] = slot
+    return params
@@ -0,0 +1,143 @@
+"""llama-server 앞단 입장 제어 — 동시 실행 수 제한 + FIFO 대기열(최대 깊이) + 요청별 마감 시간
+슬롯보다 많은 요청이 몰리면 requests.post 안에서 60/90초씩 묶이는 대신, 대기열이 차면 즉시 503으로 거절
+슬롯 번호도 여기서 배정 — 같은 세션은 직전에 쓴 슬롯(프롬프트 KV 캐시)이 비어 있으면 그 슬롯으로"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# 동시 LLM 호출 수 — 기본은 llama-server 슬롯 수(LLAMA_SLOTS), 그것도 없으면 1
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY") or os.getenv("LLAMA_SLOTS") or "1")
+LLM_QUEUE_DEPTH = int(os.getenv("LLM_QUEUE_DEPTH", "6"))        # 슬롯을 기다릴 수 있는 최대 요청 수
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))  # 대기열 최대 대기 (초)
+
+
+class Overloaded(Exception):
+    """대기열이 가득 찼거나 대기 시간 초과 — retry_after: 클라이언트에 안내할 재시도 대기 (초)"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """admit()으로 받은 대기표 — wait()로 슬롯 획득, release()로 반납 (with 문 지원)
+    입장(admit)은 검색 후 LLM을 실제로 호출할 요청만 (답변 캐시 hit, 게임 선택, 병합 대기는 대기열과 무관)
+    slot: wait() 성공 후 배정된 슬롯 번호 (0 ~ limit-1)"""
+
+    def __init__(self, scheduler, affinity=None):
+        self._scheduler = scheduler
+        self.affinity = affinity  # 세션 id 등 — 같은 값이면 직전 슬롯 우선
+        self.slot = None
+        self.acquired = False
+        self.released = False
+        self.started = None
+
+    def wait(self, timeout):
+        """슬롯 획득까지 대기 (FIFO) — timeout과 LLM_QUEUE_TIMEOUT 중 짧은 쪽을 넘기면 Overloaded
+        Returns: 대기에 쓴 시간 (초)"""
+        return self._scheduler._acquire(self, timeout)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LLMScheduler:
+    """동시 실행 limit개, 나머지는 FIFO 대기 — 대기 중인 요청이 max_queue개면 admit()이 즉시 Overloaded"""
+
+    def __init__(self, limit=LLM_CONCURRENCY, max_queue=LLM_QUEUE_DEPTH, max_wait=LLM_QUEUE_TIMEOUT):
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0       # 슬롯을 잡고 LLM 호출 중
+        self._free = list(range(self.limit))  # 빈 슬롯 (앞쪽일수록 오래 쉰 슬롯)
+        self._owner = [None] * self.limit      # 슬롯별 마지막 사용 affinity (그 슬롯 KV 캐시의 주인)
+        self._pending = 0      # 입장했지만 아직 슬롯 없음
+        self._waiters = deque()  # 슬롯 대기 중인 Ticket (FIFO)
+        self._service_ema = 10.0  # 슬롯 점유 시간 이동평균 (초) — Retry-After 추정용
+        self.rejected = 0
+
+    def _retry_after(self):
+        """대기 요청이 모두 빠질 때까지 예상 시간 (초, 1~60)"""
+        backlog = self._pending + 1
+        return max(1, min(60, math.ceil(self._service_ema * backlog / self.limit)))
+
+    def admit(self, affinity=None):
+        """대기표 발급 — 슬롯을 기다려야 할 요청이 이미 max_queue개면 Overloaded
+        affinity: 슬롯 선호 키 (세션 id) — None이면 가장 오래 쉰 슬롯"""
+        with self._cond:
+            free = self.limit - self._active
+            if self._pending - free >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("LLM 대기열이 가득 찼습니다", self._retry_after())
+            self._pending += 1
+            return Ticket(self, affinity)
+
+    def _acquire(self, ticket, timeout):
+        t0 = time.monotonic()
+        deadline = t0 + min(timeout, self.max_wait)
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket or self._active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise Overloaded("LLM 대기 시간 초과", self._retry_after())
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()  # 뒤 순번이 head가 될 수 있음
+                raise
+            self._waiters.popleft()
+            self._pending -= 1
+            self._active += 1
+            ticket.slot = self._pick_slot(ticket.affinity)
+            ticket.acquired = True
+            ticket.started = time.monotonic()
+            self._cond.notify_all()  # 슬롯이 남았으면 다음 순번도 진행
+        return ticket.started - t0
+
+    def _pick_slot(self, affinity):
+        """빈 슬롯 중 affinity가 마지막으로 쓴 슬롯, 없으면 가장 오래 쉰 슬롯 (다른 세션 캐시를 최대한 보존)"""
+        slot = self._free[0]
+        if affinity is not None:
+            for s in self._free:
+                if self._owner[s] == affinity:
+                    slot = s
+                    break
+        self._free.remove(slot)
+        self._owner[slot] = affinity
+        return slot
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.acquired:
+                self._active -= 1
+                self._free.append(ticket.slot)
+                held = time.monotonic() - ticket.started
+                self._service_ema = 0.8 * self._service_ema + 0.2 * held
+            else:
+                self._pending -= 1  # 캐시 hit 등으로 LLM 호출 없이 끝남 / 대기 시간 초과
+            self._cond.notify_all()
+
+    def stats(self):
+        """{"limit", "active", "queued", "pending", "rejected"}"""
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queued": len(self._waiters),
+                "pending": self._pending,
+                "rejected": self.rejected,
+            }
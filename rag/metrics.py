@@ -0,0 +1,113 @@
+"""단계별 지연 계측 — 요청마다 Trace로 구간 시간을 모으고, 끝나면 단계별 히스토그램에 누적
+GET /api/metrics가 Prometheus 텍스트 형식으로 노출 (히스토그램 + 카운터 + 캐시/대기열 게이지)"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 요청 1건의 단계 (Trace.stages 키) — 순서는 /api/metrics 출력 순서
+STAGES = ("typo", "rewrite", "embed", "faiss", "bm25", "fusion", "boost", "prompt", "queue", "llm", "validate")
+# 히스토그램 버킷 상한 (초) — 임베딩/BM25(ms 단위)부터 LLM 생성(수십 초)까지
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PREFIX = "gamewiki"
+
+
+class Trace:
+    """요청 1건의 단계별 소요 시간 (ms) — 같은 단계가 여러 번 돌면(재검색 등) 합산
+    outcome: 요청 결과 분류 (llm / cached / coalesced / ask_game / rejected / error)
+    info: 요청 로그용 부가 정보 (질문, intent, chunk id, 품질, 신뢰도 등)"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.stages = {}
+        self.outcome = "llm"
+        self.info = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage, ms):
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def add_timings(self, timings):
+        """Retriever 검색 timings({"embed_ms", ...}) 합산 — total_ms 제외"""
+        for key, ms in timings.items():
+            if key != "total_ms":
+                self.add(key[:-3], ms)
+
+    @contextmanager
+    def span(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - t0) * 1000)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+class Histogram:
+    """누적 버킷 히스토그램 (Prometheus 형식, 단위 초)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 마지막 칸 = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def lines(self, name, labels):
+        out = []
+        cumulative = 0
+        for le, n in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += n
+            out.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        out.append(f"{name}_count{{{labels}}} {self.count}")
+        return out
+
+
+class Metrics:
+    """단계별/엔드포인트별 히스토그램 + 결과별 요청 카운터 (스레드 안전)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}    # stage → Histogram
+        self._requests = {}  # endpoint → Histogram (요청 전체)
+        self._outcomes = {}  # (endpoint, outcome) → 건수
+
+    def record(self, trace):
+        """끝난 요청의 Trace 반영"""
+        total = trace.elapsed_ms()
+        with self._lock:
+            for stage, ms in trace.stages.items():
+                self._stages.setdefault(stage, Histogram()).observe(ms / 1000)
+            self._requests.setdefault(trace.endpoint, Histogram()).observe(total / 1000)
+            key = (trace.endpoint, trace.outcome)
+            self._outcomes[key] = self._outcomes.get(key, 0) + 1
+
+    def render(self, gauges=()):
+        """Prometheus 텍스트 노출 형식
+        gauges: [(이름, "gauge"|"counter", 설명, 값), ...] — 캐시/대기열 등 호출 시점 값"""
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda kv: (STAGES.index(kv[0]) if kv[0] in STAGES else len(STAGES), kv[0]))
+            lines = [f"# HELP {PREFIX}_stage_duration_seconds 요청 단계별 소요 시간",
+                     f"# TYPE {PREFIX}_stage_duration_seconds histogram"]
+            for stage, hist in stages:
+                lines += hist.lines(f"{PREFIX}_stage_duration_seconds", f'stage="{stage}"')
+            lines += [f"# HELP {PREFIX}_request_duration_seconds 채팅 요청 전체 소요 시간",
+                      f"# TYPE {PREFIX}_request_duration_seconds histogram"]
+            for endpoint, hist in sorted(self._requests.items()):
+                lines += hist.lines(f"{PREFIX}_request_duration_seconds", f'endpoint="{endpoint}"')
+            lines += [f"# HELP {PREFIX}_requests_total 결과별 채팅 요청 수",
+                      f"# TYPE {PREFIX}_requests_total counter"]
+            for (endpoint, outcome), n in sorted(self._outcomes.items()):
+                lines.append(f'{PREFIX}_requests_total{{endpoint="{endpoint}",outcome="{outcome}"}} {n}')
+        for name, kind, help_text, value in gauges:
+            lines += [f"# HELP {PREFIX}_{name} {help_text}",
+                      f"# TYPE {PREFIX}_{name} {kind}",
+                      f"{PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
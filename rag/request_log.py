@@ -0,0 +1,107 @@
+"""구조화 요청 로그 — 채팅 요청 1건당 JSON 1줄 (JSONL)
+요청 스레드는 큐에 넣기만 하고 파일 쓰기는 백그라운드 스레드 1개가 모아서 처리, 크기 기준 로테이션
+읽기: read_records() — 로테이션된 파일(오래된 것)부터 현재 파일까지 한 줄씩"""
+import os
+import sys
+import json
+import queue
+import threading
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "log")
+REQUEST_LOG = os.getenv("REQUEST_LOG", os.path.join(LOG_DIR, "requests.jsonl"))
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(20 * 1024 * 1024)))  # 파일당 최대 크기
+REQUEST_LOG_BACKUPS = int(os.getenv("REQUEST_LOG_BACKUPS", "5"))  # requests.jsonl.1 ~ .N 보관 개수
+
+_STOP = object()
+
+
+class RequestLog:
+    """백그라운드 JSONL 기록기 — write()는 블록하지 않음 (큐가 가득 차면 버리고 dropped 증가)"""
+
+    def __init__(self, path=REQUEST_LOG, max_bytes=REQUEST_LOG_MAX_BYTES, backups=REQUEST_LOG_BACKUPS, max_queue=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name="request-log", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """남은 레코드를 모두 쓰고 종료 (atexit)"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 256:  # 밀린 레코드는 한 번에 모아서 쓰기
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(r is _STOP for r in batch)
+            lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in batch if r is not _STOP)
+            try:
+                self._append(lines)
+            except OSError as e:
+                print(f"[요청 로그] 기록 실패: {e}", file=sys.stderr, flush=True)
+                if self._file is not None:
+                    try:
+                        self._file.close()  # 다음 배치에서 다시 열기 — 실패할 때마다 fd가 새지 않도록
+                    except OSError:
+                        pass
+                self._file = None
+            if stop:
+                if self._file:
+                    self._file.close()
+                return
+
+    def _append(self, lines):
+        if not lines:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(lines)
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """requests.jsonl → .1 → .2 ... (.backups 초과분 삭제)"""
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def read_records(path=REQUEST_LOG):
+    """요청 로그 스트리밍 읽기 — 오래된 순 (path.N … path.1, path), 깨진 줄은 건너뜀"""
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    for p in rotated[::-1] + [path]:
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
@@ -0,0 +1,318 @@
+"""하이브리드 검색 파이프라인 — 벡터 + BM25 → RRF → 제목 부스트 → 문맥 부스트
+/api/chat의 모든 경로(단일/품질 재검색/오타 재검색/멀티스텝)가 Retriever.search()를 공유"""
+import os
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.vectorstores import FAISS
+from bm25 import BM25Index, tokenize_ko, corpus_fingerprint
+from title_index import TitleIndex, TITLE_EXACT, TITLE_MULTI, TITLE_PARTIAL
+from reranker import contextual_boost
+
+RRF_K = 60  # Reciprocal Rank Fusion 파라미터
+# 게임별 파티션의 소속 표시 (ingest.py가 기록) — {"game", "parent": 전체 인덱스 corpus_fingerprint}
+# 파티션의 chunk_id는 전체 인덱스 번호라서 다른 ingest 결과와 섞이면 엉뚱한 문서를 가리킴
+PARTITION_META = "partition.json"
+
+INTENT_WEIGHTS = {
+    "stat":    (0.4, 0.6),  # 수치 질문 → BM25 우세 (키워드 정확도)
+    "howto":   (0.6, 0.4),  # 방법 질문 → Vector 우세 (의미론적)
+    "list":    (0.6, 0.4),  # 목록 질문 → Vector 우세
+    "compare": (0.6, 0.4),  # 비교 질문 → Vector 우세
+    "general": (0.6, 0.4),  # 일반 → Vector 우세 (의미론적 유사도 중시)
+}
+# 제목 매칭 부스트 (정확 매칭 / 키워드 2개 이상 / 키워드 1개)
+TITLE_BOOST = {TITLE_EXACT: 15.0, TITLE_MULTI: 5.0, TITLE_PARTIAL: 2.0}
+
+
+def classify_intent(query):
+    """질문 의도 분류 — 검색 가중치 조절에 사용"""
+    stat_words = ["체력", "HP", "hp", "공격력", "방어력", "데미지", "스탯", "수치", "몇", "얼마"]
+    howto_words = ["어떻게", "방법", "하는법", "만드는법", "잡는법", "가는법", "공략", "팁", "가이드", "만들어"]
+    list_words = ["종류", "목록", "리스트", "뭐가있", "알려줘", "적성", "스킬", "드롭"]
+    compare_words = ["차이", "비교", "vs", "VS", "좋은", "강한", "약한", "추천"]
+
+    if any(w in query for w in stat_words):
+        return "stat"
+    if any(w in query for w in compare_words):
+        return "compare"
+    if any(w in query for w in howto_words):
+        return "howto"
+    if any(w in query for w in list_words):
+        return "list"
+    return "general"
+
+
+def partition_parent(path):
+    """파티션 디렉토리가 어느 전체 인덱스로부터 만들어졌는지 (PARTITION_META의 parent, 없으면 None)"""
+    try:
+        with open(os.path.join(path, PARTITION_META), encoding="utf-8") as f:
+            return json.load(f).get("parent")
+    except (OSError, ValueError):
+        return None
+
+
+def load_index(path, embeddings):
+    """FAISS 인덱스 + BM25 로드 → (vdb, bm25_index)
+    BM25는 저장본을 mmap 로드, 없거나 FAISS와 어긋나면(stale) 재구축 후 저장
+    BM25 문서 순서 = docstore 순서 (list(vdb.docstore._dict.values()))"""
+    vdb = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    docs = list(vdb.docstore._dict.values())
+    bm25_path = os.path.join(path, "bm25")
+    fingerprint = corpus_fingerprint(vdb.docstore._dict.keys())
+    index = BM25Index.load(bm25_path, fingerprint)
+    if index is None:
+        corpus = [tokenize_ko(doc.page_content) for doc in docs]
+        index = BM25Index.build(corpus)
+        try:
+            index.save(bm25_path, fingerprint)
+        except OSError as e:
+            print(f"⚠️ BM25 인덱스 저장 실패 ({bm25_path}): {e}")
+        print(f"  BM25 재구축 ({path}, {len(docs)}개 문서)")
+    return vdb, index
+
+
+def chunk_id_maps(vdb, legacy=None):
+    """인덱스 위치 → 전역 chunk id 배열 → (vec_ids[FAISS 위치], bm25_ids[docstore 순서])
+    chunk id는 ingest.py가 metadata["chunk_id"]에 넣은 값
+    구버전 faiss_db(chunk_id 없음)는 legacy {(source, 본문): chunk id}로 전체 인덱스 id를 찾음"""
+    store_ids = {}  # docstore id → chunk id
+    for store_id, doc in vdb.docstore._dict.items():
+        if legacy is None:
+            store_ids[store_id] = doc.metadata["chunk_id"]
+        else:
+            store_ids[store_id] = legacy[(doc.metadata.get("source"), doc.page_content)]
+    vec_ids = np.array([store_ids[vdb.index_to_docstore_id[j]] for j in range(len(vdb.index_to_docstore_id))], dtype=np.int64)
+    bm25_ids = np.fromiter(store_ids.values(), dtype=np.int64, count=len(store_ids))
+    return vec_ids, bm25_ids
+
+
+def _timed(fn, *args):
+    """(결과, 소요 ms)"""
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+class Hit:
+    """검색 결과 1건 — 단계별 점수 (score = rrf + title + context)
+    vector_rank / bm25_rank: 각 leg에서의 순위 (0부터, 없으면 None)"""
+
+    def __init__(self, chunk_id, doc):
+        self.chunk_id = chunk_id
+        self.doc = doc
+        self.vector_rank = None
+        self.bm25_rank = None
+        self.rrf = 0.0
+        self.title = 0.0
+        self.context = 0.0
+
+    @property
+    def score(self):
+        return self.rrf + self.title + self.context
+
+
+class SearchResult:
+    """search() 결과 — hits는 최종 점수 내림차순"""
+
+    def __init__(self, query, game, intent, hits, timings):
+        self.query = query
+        self.game = game
+        self.intent = intent
+        self.hits = hits
+        self.timings = timings  # {"embed_ms", "faiss_ms", "bm25_ms", "total_ms", "fusion_ms", "boost_ms"} (leg 시간은 배치 전체)
+
+    @property
+    def weights(self):
+        return INTENT_WEIGHTS.get(self.intent, (0.6, 0.4))
+
+    def docs(self, n=None):
+        return [h.doc for h in self.hits[:n]]
+
+    def fused(self):
+        """RRF + 제목 부스트 기준 [(score, doc), ...] — calculate_search_quality 입력용 (문맥 부스트 제외)"""
+        pairs = [(h.rrf + h.title, h.doc) for h in self.hits]
+        return sorted(pairs, key=lambda x: x[0], reverse=True)
+
+
+class Retriever:
+    """전체 인덱스 + 게임별 파티션 + 제목 인덱스를 들고 있는 검색 파이프라인
+    검색 결과는 전역 chunk id로 다루고 self.chunks[chunk id]로 문서 조회"""
+
+    def __init__(self, db_dir, embeddings, workers=8):
+        self.embeddings = embeddings  # CachedEmbeddings — 전체/파티션 인덱스가 공유
+        self.indexes = {}  # {None: 전체, game: 파티션} → (vdb, bm25_index, vec_ids, bm25_ids)
+        # 벡터/BM25 leg 병렬 실행용 (HTTP 워커마다 BM25 leg 하나씩 동시에 돌 수 있도록)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval")
+
+        vdb, bm25 = load_index(db_dir, embeddings)
+        docs = list(vdb.docstore._dict.values())
+        legacy = None
+        if docs and all("chunk_id" in d.metadata for d in docs):
+            self.chunks = [None] * (max(d.metadata["chunk_id"] for d in docs) + 1)
+            for doc in docs:
+                self.chunks[doc.metadata["chunk_id"]] = doc
+        else:
+            # 구버전 faiss_db — docstore 순서로 id 부여 (파티션은 본문으로 매칭)
+            print("⚠️ chunk_id 없는 인덱스 — 로드 순서로 id 부여 (ingest.py 재실행 권장)")
+            legacy = {}
+            for i, doc in enumerate(docs):
+                doc.metadata["chunk_id"] = i
+                legacy[(doc.metadata.get("source"), doc.page_content)] = i
+            self.chunks = docs
+        self.db = vdb
+        self.indexes[None] = (vdb, bm25) + chunk_id_maps(vdb, legacy)
+        print(f"✅ 벡터DB + BM25 로드 완료 ({len(docs)}개 문서)")
+        # 게임별 파티션 (ingest.py가 faiss_db/<game>/에 저장) — 없으면 전체 인덱스 + 게임 필터로 동작
+        parent = corpus_fingerprint(vdb.docstore._dict.keys())
+        for name in sorted(os.listdir(db_dir)):
+            path = os.path.join(db_dir, name)
+            if os.path.isfile(os.path.join(path, "index.faiss")):
+                # 구버전(legacy)은 본문으로 id를 찾으므로 검사 불필요
+                if legacy is None and partition_parent(path) != parent:
+                    print(f"⚠️ 파티션 {name}: 현재 전체 인덱스와 다른 ingest 결과 — 건너뜀 (ingest.py 재실행 권장)")
+                    continue
+                part_vdb, part_bm25 = load_index(path, embeddings)
+                self.indexes[name] = (part_vdb, part_bm25) + chunk_id_maps(part_vdb, legacy)
+                print(f"  └ 파티션 {name}: {len(part_vdb.index_to_docstore_id)}개 문서")
+        self.title_index = TitleIndex([d.metadata.get("title", "") if d else "" for d in self.chunks])
+        print(f"  └ 제목 인덱스: {len(self.title_index)}개 제목")
+        # 출처 "game/title" → 첫 chunk id (세션 캐시가 출처를 정수로 들고 있다가 source_name()으로 복원)
+        self.source_ids = {}
+        for cid, doc in enumerate(self.chunks):
+            if doc is not None:
+                self.source_ids.setdefault(self.source_name(cid), cid)
+
+    def source_name(self, cid):
+        """chunk id → 답변 출처 표기 (game/title)"""
+        meta = self.chunks[cid].metadata
+        return f"{meta.get('game', '')}/{meta.get('title', '')}"
+
+    # ── 검색 leg ──
+    def _target(self, game):
+        """검색할 인덱스 키 — 게임 파티션이 있으면 그 게임, 없으면 None(전체 인덱스 + 게임 필터)"""
+        return game if game in self.indexes else None
+
+    def _filter_game(self, ids, game):
+        return [cid for cid in ids if self.chunks[cid].metadata.get("game", "") == game]
+
+    def vector_search(self, query, k, game=None):
+        """벡터 검색 → chunk id 리스트 (유사도 순)
+        게임 파티션이 있으면 그 인덱스에서 k개 (필터 후 결과가 줄지 않음)
+        파티션이 없으면 전체 인덱스 검색 후 게임 필터 (구버전 faiss_db 호환)"""
+        return self.vector_search_batch([query], k, [game])[0]
+
+    def vector_search_batch(self, queries, k, games):
+        """여러 쿼리 벡터 검색 — 임베딩은 한 번의 배치 forward pass, FAISS는 파티션별 배치 search 1회
+        Returns: 쿼리 순서대로 [chunk ids, ...] (vector_search와 같은 파티션/필터 규칙)"""
+        return self._vector_batch(queries, k, games)[0]
+
+    def _vector_batch(self, queries, k, games):
+        """vector_search_batch + 단계 시간 → (결과, 임베딩 ms, FAISS ms)"""
+        vectors, embed_ms = _timed(self.embeddings.embed_queries, queries)
+        t0 = time.perf_counter()
+        results = [None] * len(queries)
+        groups = {}  # 검색할 인덱스 키(파티션 게임 또는 None=전체) → 쿼리 위치들
+        for i, game in enumerate(games):
+            groups.setdefault(self._target(game), []).append(i)
+        for key, idxs in groups.items():
+            vdb, _, vec_ids, _ = self.indexes[key]
+            x = np.array([vectors[i] for i in idxs], dtype=np.float32)
+            if getattr(vdb, "_normalize_L2", False):
+                x /= np.linalg.norm(x, axis=1, keepdims=True)
+            _, hits = vdb.index.search(x, k)
+            for i, row in zip(idxs, hits):
+                ids = [int(vec_ids[j]) for j in row if j != -1]
+                if games[i] and key is None:
+                    ids = self._filter_game(ids, games[i])
+                results[i] = ids
+        return results, embed_ms, (time.perf_counter() - t0) * 1000
+
+    def bm25_search(self, query, k, game=None):
+        """BM25 검색 → chunk id 리스트 (점수 순, vector_search와 같은 파티션 규칙)"""
+        key = self._target(game)
+        _, index, _, bm25_ids = self.indexes[key]
+        ids = [int(bm25_ids[i]) for i, _ in index.top_k(tokenize_ko(query), k)]
+        if game and key is None:
+            ids = self._filter_game(ids, game)
+        return ids
+
+    def _bm25_batch(self, queries, k, games):
+        return [self.bm25_search(q, k, g) for q, g in zip(queries, games)]
+
+    def hybrid_search_batch(self, queries, k, games):
+        """벡터 leg와 BM25 leg 동시 실행 → ([vec_ids, ...], [bm25_ids, ...], {"embed_ms", "faiss_ms", "bm25_ms", "total_ms"})
+        BM25는 검색 풀 스레드에서, 벡터는 현재 스레드에서 (임베딩/FAISS는 GIL을 놓으므로 실제로 겹침)
+        게임 필터 결과 벡터 leg가 비면 전체 인덱스로 fallback"""
+        t0 = time.perf_counter()
+        fut = self._pool.submit(_timed, self._bm25_batch, queries, k, games)
+        vec_all, embed_ms, faiss_ms = self._vector_batch(queries, k, games)
+        lex_all, lex_ms = fut.result()
+        for i, game in enumerate(games):
+            if game and not vec_all[i]:
+                (vec_all[i],), e_ms, f_ms = self._vector_batch([queries[i]], k, [None])
+                embed_ms += e_ms
+                faiss_ms += f_ms
+        total_ms = (time.perf_counter() - t0) * 1000
+        return vec_all, lex_all, {"embed_ms": embed_ms, "faiss_ms": faiss_ms, "bm25_ms": lex_ms, "total_ms": total_ms}
+
+    # ── 점수 단계 ──
+    def _fuse(self, query, game, intent, vec_ids, bm25_ids, title_boost, context):
+        """RRF → 제목 부스트(+ 제목 정확 매칭 문서 보충) → 문맥 부스트 → (점수순 Hit 리스트, {"fusion_ms", "boost_ms"})"""
+        t0 = time.perf_counter()
+        vec_w, bm25_w = INTENT_WEIGHTS.get(intent, (0.6, 0.4))
+        hits = {}  # chunk id → Hit
+        for rank, cid in enumerate(vec_ids):
+            hit = hits.get(cid)
+            if hit is None:
+                hit = hits[cid] = Hit(cid, self.chunks[cid])
+            hit.vector_rank = rank
+            hit.rrf += vec_w / (RRF_K + rank + 1)
+        for rank, cid in enumerate(bm25_ids):
+            hit = hits.get(cid)
+            if hit is None:
+                hit = hits[cid] = Hit(cid, self.chunks[cid])
+            hit.bm25_rank = rank
+            hit.rrf += bm25_w / (RRF_K + rank + 1)
+        t1 = time.perf_counter()
+
+        if title_boost:
+            # 제목이 질의와 정확 매칭되는데 두 leg 모두 놓친 문서 → 첫 청크를 RRF 0점 후보로 추가
+            seen = {hit.doc.metadata.get("title", "") for hit in hits.values()}
+            tiers = self.title_index.match_titles(query)
+            for cid in self.title_index.exact_leads(tiers):
+                doc = self.chunks[cid]
+                if doc.metadata.get("title", "") in seen:
+                    continue
+                if game and doc.metadata.get("game", "") != game:
+                    continue
+                hits[cid] = Hit(cid, doc)
+            for cid, tier in self.title_index.match(tiers).items():
+                if cid in hits:
+                    hits[cid].title = title_boost.get(tier, 0.0)
+
+        if context:
+            for hit in hits.values():
+                hit.context = contextual_boost(hit.doc, query, 0.0)
+
+        ranked = sorted(hits.values(), key=lambda h: h.score, reverse=True)
+        t2 = time.perf_counter()
+        return ranked, {"fusion_ms": (t1 - t0) * 1000, "boost_ms": (t2 - t1) * 1000}
+
+    def search(self, query, k, game=None, intent=None, title_boost=TITLE_BOOST, context=True):
+        """하이브리드 검색 → SearchResult
+        k: leg별 검색 수, game: 게임 파티션/필터, intent: RRF 가중치 (None이면 classify_intent)
+        title_boost: {TITLE_*: 점수} (None이면 제목 부스트 생략), context: 문맥 부스트 적용 여부"""
+        return self.search_batch([query], k, [game], [intent], title_boost, context)[0]
+
+    def search_batch(self, queries, k, games, intents=None, title_boost=TITLE_BOOST, context=True):
+        """여러 쿼리 search() — 벡터 leg는 배치 1회, BM25 leg는 병렬 스레드에서"""
+        intents = intents or [None] * len(queries)
+        intents = [it or classify_intent(q) for q, it in zip(queries, intents)]
+        vec_all, lex_all, timings = self.hybrid_search_batch(queries, k, games)
+        results = []
+        for q, g, it, v, b in zip(queries, games, intents, vec_all, lex_all):
+            hits, fuse_timings = self._fuse(q, g, it, v, b, title_boost, context)
+            results.append(SearchResult(q, g, it, hits, dict(timings, **fuse_timings)))
+        return results
@@ -0,0 +1,58 @@
+"""세션 캐시 레코드 — 메시지/세션을 dict 대신 __slots__ 객체로 (인스턴스 __dict__ 없음)
+role은 Role enum 싱글턴, sources는 chunk id 튜플 (검색 인덱스에 없는 출처만 "game/title" 문자열 그대로)"""
+import sys
+from enum import IntEnum
+
+
+class Role(IntEnum):
+    USER = 0
+    ASSISTANT = 1
+    SYSTEM = 2
+
+    @property
+    def label(self):
+        """DB/API 표기 ("user", "assistant", "system")"""
+        return self.name.lower()
+
+    @classmethod
+    def parse(cls, label):
+        return cls[label.upper()]
+
+
+class Message:
+    __slots__ = ("role", "content", "sources", "ts")
+
+    def __init__(self, role, content, sources=(), ts=0.0):
+        self.role = role
+        self.content = content
+        self.sources = sources
+        self.ts = ts
+
+    def nbytes(self):
+        """대략적인 메모리 사용량 (바이트) — 작은 정수(chunk id < 257)는 공유 객체라 제외"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.content) + sys.getsizeof(self.sources)
+        return size + sum(sys.getsizeof(s) for s in self.sources if not (isinstance(s, int) and s < 257))
+
+
+class Session:
+    """캐시된 세션 1개
+    DB 저장 상태: messages[:saved]는 이미 DB에 있음 (새 메시지는 항상 뒤에 붙으므로 저장분은 앞쪽 구간)
+    trimmed: 앞쪽 메시지가 잘려 DB에서도 범위 삭제 필요, replace: DB 메시지를 통째로 교체 (/clear, 만료)
+    nbytes: 추정 메모리 사용량, used: 마지막 접근 시각 (eviction 중 다시 쓰인 세션은 남기기 위함)
+    dropped: MAX_MESSAGES 제한으로 앞에서 잘린 메시지 수 (프롬프트 이전 대화 구간을 절대 위치로 고정)"""
+    __slots__ = ("title", "game", "last_query", "messages", "last_active", "used",
+                 "dirty", "saved", "trimmed", "replace", "nbytes", "dropped")
+
+    def __init__(self, title, last_active, used):
+        self.title = title
+        self.game = None
+        self.last_query = ""
+        self.messages = []
+        self.last_active = last_active
+        self.used = used
+        self.dirty = False
+        self.saved = 0
+        self.trimmed = False
+        self.replace = False
+        self.nbytes = 0
+        self.dropped = 0
@@ -0,0 +1,62 @@
+"""요청 병합 (single-flight) — 같은 키의 작업이 진행 중이면 새로 실행하지 않고 그 결과를 같이 받음
+QA cron과 실제 사용자가 같은 질문을 동시에 보내도 LLM 생성은 한 번만"""
+import threading
+
+
+class Abandoned(Exception):
+    """리더가 결과 없이 작업을 그만둠 (예: 스트리밍 클라이언트 연결 끊김) — 대기자에게 전달하지 않고 대기자가 다시 실행"""
+
+
+class Flight:
+    """진행 중인 작업 1건 — waiters: 결과를 기다리는 후속 요청 수"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key → Flight
+        self.shared = 0  # 병합된 요청 수 (누적)
+
+    def do(self, key, fn):
+        """key로 진행 중인 작업이 없으면 fn(flight) 실행, 있으면 끝날 때까지 대기 후 같은 결과
+        Returns: (result, shared) — shared=True면 다른 요청의 결과. 실행 중 예외는 대기자에게도 전달
+        (Abandoned만 예외 — 리더 자신에게만 올라가고 대기자는 리더가 되어 다시 실행)"""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                else:
+                    flight.waiters += 1
+                    self.shared += 1
+            if leader:
+                break
+            flight.done.wait()
+            if isinstance(flight.error, Abandoned):
+                with self._lock:
+                    self.shared -= 1
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn(flight)
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
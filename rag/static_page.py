@@ -0,0 +1,84 @@
+"""정적 페이지 응답 — 시작 시 한 번 인코딩 + 미리 압축 (gzip, brotli 설치 시 br)
+요청마다 Accept-Encoding으로 고른 바이트를 그대로 전송, ETag가 같으면 304"""
+import gzip
+import hashlib
+
+try:
+    import brotli  # 선택 의존성 (pip install brotli) — 없으면 gzip만
+except ImportError:
+    brotli = None
+
+PREFERENCE = ("br", "gzip", "identity")  # q값이 같으면 작은 쪽 우선
+
+
+def etag_matches(header, etag):
+    """If-None-Match 헤더에 etag가 있는지 (약한 비교 W/, * 포함)"""
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def accepted_encodings(header):
+    """Accept-Encoding → {인코딩: q} (헤더 없으면 identity만)"""
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class StaticPage:
+    """변하지 않는 페이지 1개 — 인코딩별 본문 + ETag를 미리 계산"""
+
+    def __init__(self, text, content_type="text/html; charset=utf-8", cache_control="no-cache"):
+        raw = text.encode()
+        self.content_type = content_type
+        self.cache_control = cache_control  # no-cache: 매번 ETag로 재검증 (재시작 후 바뀐 페이지도 바로 반영)
+        self.bodies = {"identity": raw}
+        self.bodies["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(raw, quality=11)
+        digest = hashlib.sha1(raw).hexdigest()[:16]
+        # 인코딩마다 바이트가 다르므로 ETag도 따로
+        self.etags = {enc: f'"{digest}"' if enc == "identity" else f'"{digest}-{enc}"' for enc in self.bodies}
+
+    def sizes(self):
+        return {enc: len(body) for enc, body in self.bodies.items()}
+
+    def negotiate(self, accept_encoding):
+        """보낼 인코딩 — q가 가장 높은 것, 같으면 PREFERENCE 순 (q=0은 제외)"""
+        accepted = accepted_encodings(accept_encoding)
+        wildcard = accepted.get("*")
+        best, best_q = "identity", 0.0
+        for enc in PREFERENCE:
+            if enc not in self.bodies:
+                continue
+            # 목록에 없는 identity는 항상 허용하되 명시된 압축보다 뒤로
+            q = accepted.get(enc, wildcard if wildcard is not None else (0.001 if enc == "identity" else 0.0))
+            if q > best_q:
+                best, best_q = enc, q
+        return best
+
+    def response(self, accept_encoding, if_none_match):
+        """→ (status, headers, body) — ETag가 같으면 304 + 빈 본문"""
+        enc = self.negotiate(accept_encoding)
+        headers = {"ETag": self.etags[enc], "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, self.etags[enc]):
+            return 304, headers, b""
+        body = self.bodies[enc]
+        headers["Content-Type"] = self.content_type
+        headers["Content-Length"] = str(len(body))
+        if enc != "identity":
+            headers["Content-Encoding"] = enc
+        return 200, headers, body
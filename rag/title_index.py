@@ -0,0 +1,140 @@
+"""제목 매칭 인덱스 — 청크 제목을 로드 시 한 번만 정규화, 질의 1회 스캔으로 제목 부스트 대상 탐색
+- 제목 ⊂ 질의: Aho-Corasick (질의 길이만큼 한 번 훑으면 포함된 제목 전부)
+- 질의 ⊂ 제목, 키워드 ⊂ 제목: 정규화 제목을 이어붙인 문자열에서 str.find"""
+from bisect import bisect_right
+from collections import deque
+
+# 매칭 단계 (높을수록 강한 매칭) — 점수는 호출 측에서 결정
+TITLE_EXACT = 3    # 정규화 질의 ⊂ 제목 또는 제목 ⊂ 질의
+TITLE_MULTI = 2    # 키워드 2개 이상이 정규화 제목에 포함
+TITLE_PARTIAL = 1  # 키워드 1개 이상이 (소문자) 제목에 포함
+
+_SEP = "\n"  # 제목/질의에 나올 수 없는 구분자 (경계를 넘는 매칭 방지)
+
+
+def normalize_title(text):
+    """소문자 + 공백/특수문자(: _ / -) 제거"""
+    return text.lower().replace(" ", "").replace(":", "").replace("_", "").replace("/", "").replace("-", "")
+
+
+def query_words(query):
+    """부스트용 키워드 (2글자 이상 어절)"""
+    return [w for w in query.split() if len(w) > 1]
+
+
+class _Joined:
+    """문자열 리스트를 _SEP로 이어붙여 부분 문자열 검색 → 포함된 원소 번호"""
+
+    def __init__(self, texts):
+        self.text = _SEP.join(texts)
+        self.starts = []
+        pos = 0
+        for t in texts:
+            self.starts.append(pos)
+            pos += len(t) + len(_SEP)
+
+    def containing(self, needle):
+        """needle을 포함하는 원소 번호 set"""
+        found = set()
+        if not needle or _SEP in needle:
+            return found
+        i = self.text.find(needle)
+        while i != -1:
+            n = bisect_right(self.starts, i) - 1
+            found.add(n)
+            # 같은 원소 안의 나머지 등장은 건너뜀
+            nxt = self.starts[n + 1] if n + 1 < len(self.starts) else len(self.text)
+            i = self.text.find(needle, nxt)
+        return found
+
+
+class _AhoCorasick:
+    """패턴 집합 → 텍스트 1회 스캔으로 등장한 패턴 번호 전부"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pid, p in enumerate(patterns):
+            node = 0
+            for ch in p:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pid)
+        # BFS로 실패 링크 + 출력 병합
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            found.update(self.out[node])
+        return found
+
+
+class TitleIndex:
+    """chunk id → 제목을 받아 고유 제목 단위로 인덱싱
+    match()는 {chunk id: TITLE_*} 반환 — 기존 제목 부스트 루프와 같은 판정 규칙
+    match()/exact_leads()는 match_titles() 결과를 받음 → 질의당 스캔 1회로 둘 다 계산"""
+
+    def __init__(self, titles):
+        by_title = {}  # 원 제목 → [chunk id, ...]
+        for cid, title in enumerate(titles):
+            if title:  # 빈 제목은 모든 질의에 "포함"되므로 제외
+                by_title.setdefault(title, []).append(cid)
+        self.titles = list(by_title)
+        self.chunk_ids = [by_title[t] for t in self.titles]
+        self.lower = [t.lower() for t in self.titles]
+        self.clean = [normalize_title(t) for t in self.titles]
+        self._clean_joined = _Joined(self.clean)
+        self._lower_joined = _Joined(self.lower)
+        self._ac = _AhoCorasick(self.clean)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def match_titles(self, query):
+        """{제목 번호: TITLE_*}"""
+        query_clean = query.lower().replace(" ", "")
+        words = query_words(query)
+        tiers = {}
+        if query_clean:
+            for n in self._ac.find(query_clean) | self._clean_joined.containing(query_clean):
+                tiers[n] = TITLE_EXACT
+        counts = {}
+        for w in words:
+            for n in self._clean_joined.containing(w):
+                counts[n] = counts.get(n, 0) + 1
+        for n, c in counts.items():
+            if c >= 2 and n not in tiers:
+                tiers[n] = TITLE_MULTI
+        for w in words:
+            for n in self._lower_joined.containing(w):
+                tiers.setdefault(n, TITLE_PARTIAL)
+        return tiers
+
+    def match(self, tiers):
+        """match_titles() 결과 → {chunk id: TITLE_*} — 매칭된 제목의 모든 청크"""
+        return {cid: tier for n, tier in tiers.items() for cid in self.chunk_ids[n]}
+
+    def exact_leads(self, tiers):
+        """match_titles() 결과 → 제목이 정확 매칭된 문서의 첫 청크 id 리스트 (검색 leg가 놓친 문서 보충용)"""
+        return [self.chunk_ids[n][0] for n, tier in tiers.items() if tier == TITLE_EXACT]
@@ -2,27 +2,43 @@
 import os
 import sys
 import json
+import hashlib
 import re
-import sqlite3
 import time
 import uuid
 import threading
 import atexit
-import requests
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from rank_bm25 import BM25Okapi
+from embed_cache import CachedEmbeddings
+from retrieval import Retriever, classify_intent, TITLE_EXACT
+from answer_cache import AnswerCache, normalize_query
+from singleflight import SingleFlight, Abandoned
 from typo_fix import fix_typo
 from multi_step import detect_complex_query, merge_results, build_multi_step_prompt
-from reranker import calculate_search_quality, should_retry_search, expand_query_for_retry, contextual_boost
+from reranker import calculate_search_quality, should_retry_search, expand_query_for_retry
 from validator import validate_answer
+import llm_client
+from llm_scheduler import LLMScheduler, Overloaded, LLM_CONCURRENCY, LLM_QUEUE_DEPTH
+from metrics import Metrics, Trace
+from request_log import RequestLog
+import chat_store
+from session_records import Role, Message, Session
+from static_page import StaticPage, etag_matches
 
 DB_DIR = os.path.join(os.path.dirname(__file__), "faiss_db")
-CHAT_DB = os.path.join(os.path.dirname(__file__), "chat.db")
 LLAMA_URL = "http://localhost:8090/completion"
 PORT = 3334
+UI_WORKERS = 4  # LLM 대기열이 가득 차도 UI/세션/메트릭 요청용으로 남는 워커 수
+# 동시 처리 요청 수 (워커 풀 크기) — 기본은 LLM 호출 중 + 대기열 최대 + UI_WORKERS
+MAX_WORKERS = int(os.getenv("GAME_WIKI_WORKERS") or LLM_CONCURRENCY + LLM_QUEUE_DEPTH + UI_WORKERS)
 API_KEY = os.getenv("GAME_WIKI_API_KEY")  # 환경변수에서 API 키 읽기 (없으면 None)
+SESSION_PAGE = (50, 200)   # GET /api/sessions ?limit= (기본, 최대)
+MESSAGE_PAGE = (50, 200)   # GET /api/sessions/<id>/messages ?limit= (기본, 최대)
 
 SYSTEM_PROMPT = """너는 게임 위키 도우미야. **참고 자료의 정보를 EXACTLY 그대로 전달**해야 해.
 
@@ -45,10 +61,6 @@ SYSTEM_PROMPT = """너는 게임 위키 도우미야. **참고 자료의 정보
 
 4. **언어 제약**: 한국어로만 답변하세요. 위키 문법, HTML 태그, 코드는 제거하세요.
 
-# 참고 자료
-
-{context}
-
 # 답변 예시 (참고 자료에서 EXACT 인용!)
 
 질문: "오버워치 리퍼의 능력은?"
@@ -62,178 +74,386 @@ SYSTEM_PROMPT = """너는 게임 위키 도우미야. **참고 자료의 정보
 
 질문: "다이아몬드는 어디서 나와?"
 답변: "참고 자료에 다이아몬드 획득 위치 정보가 없습니다."
+"""
+
 
-이제 답변하세요:"""
-
-# ── SQLite 초기화 ──
-def init_chat_db():
-    conn = sqlite3.connect(CHAT_DB)
-    conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
-        id TEXT PRIMARY KEY,
-        title TEXT,
-        created_at REAL,
-        updated_at REAL
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id TEXT,
-        role TEXT,
-        content TEXT,
-        sources TEXT,
-        created_at REAL,
-        FOREIGN KEY (session_id) REFERENCES sessions(id)
-    )""")
-    conn.commit()
-    conn.close()
-
-def get_chat_conn():
-    return sqlite3.connect(CHAT_DB)
-
-init_chat_db()
+def build_prompt(context, question, history=""):
+    """프롬프트 조립 — 고정 규칙/예시(모든 요청 동일) → 이전 대화(같은 세션이면 앞부분 동일) → 참고 자료 → 질문
+    llama-server가 바이트가 같은 앞부분의 KV 캐시를 재사용하므로 요청마다 바뀌는 부분은 뒤로 보냄"""
+    prompt = SYSTEM_PROMPT
+    if history:
+        prompt += f"\n[이전 대화]\n{history}"
+    return prompt + f"\n# 참고 자료\n\n{context}\n\n이제 답변하세요:\n\n질문: {question}\n\n답변:"
+
+
+# ── SQLite 초기화 ── (chat_store: 스레드별 커넥션 + WAL + 인덱스)
+chat_store.init_db()
 
 # ── 인메모리 세션 캐시 + 지연 저장 ──
-FLUSH_DELAY = 30  # 30초 무응답 시 DB 저장
+FLUSH_DELAY = 30     # 30초 무응답 시 DB 저장
+FLUSH_INTERVAL = 5   # 플러셔가 dirty 세션을 확인하는 주기 (초)
+# 메모리 예산 — API 클라이언트가 session_id를 마음대로 만들 수 있으므로 상한 필수
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "2000"))                  # 메모리에 둘 최대 세션 수
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_MB", "64")) * 1024 * 1024  # 메시지 추정 크기 합 상한
+SESSION_IDLE_EVICT = int(os.getenv("SESSION_IDLE_EVICT", "1800"))  # 이 시간(초) 동안 대화 없는 세션은 메모리에서 내림
+REAP_INTERVAL = 60   # 유휴 세션 정리 주기 (초)
+HISTORY_MAX = 4     # 프롬프트에 넣는 이전 대화 최대 메시지 수 (기존 상한 유지)
+HISTORY_BLOCK = 4   # 이전 대화를 자르는 단위 (메시지 수) — 자른 직후 2개부터 다시 쌓여 한 턴 걸러 앞부분(KV 캐시) 유지
+_SESSION_OVERHEAD = 512  # 세션 레코드 + 메시지 리스트 추정 크기 (바이트)
+
+
+def source_ids(sources):
+    """"game/title" 출처 리스트 → 캐시 저장용 chunk id 튜플 (인덱스 로드 전이거나 모르는 출처는 문자열 그대로)"""
+    ids = retriever.source_ids if retriever is not None else {}
+    return tuple(ids.get(src, src) for src in sources or ())
+
+
+def source_names(sources):
+    """source_ids()의 역변환 → "game/title" 리스트"""
+    return [retriever.source_name(src) if isinstance(src, int) else src for src in sources]
+
+
+def message_row(msg):
+    """Message → chat.db messages 행과 같은 (role, content, sources JSON, created_at)"""
+    return msg.role.label, msg.content, json.dumps(source_names(msg.sources)) if msg.sources else None, msg.ts
+
 
 class SessionCache:
-    """채팅 중에는 메모리만 사용, 일정 시간 후 DB에 배치 저장"""
+    """채팅 중에는 메모리만 사용, 일정 시간 후 DB에 배치 저장
+    저장은 백그라운드 플러셔 스레드 1개가 dirty 세션을 모아 한 트랜잭션으로 (세션마다 Timer 스레드 X)
+    메모리는 세션 수/추정 바이트 예산 안에서 LRU — 내릴 세션은 먼저 DB에 저장, 다시 오면 load_from_db로 복원"""
     SESSION_TIMEOUT = 1800  # 30분 (초)
     MAX_MESSAGES = 50       # 세션당 최대 메시지 수
     
-    def __init__(self):
+    def __init__(self, max_sessions=SESSION_CACHE_MAX, max_bytes=SESSION_CACHE_MAX_BYTES, idle_evict=SESSION_IDLE_EVICT):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_evict = idle_evict
         self._lock = threading.Lock()
-        self._sessions = {}  # {sid: {"game": str, "last_query": str, "messages": [...], "dirty": bool, "last_active": float, "title": str}}
-        self._timers = {}    # {sid: Timer}
+        self._flush_lock = threading.Lock()  # DB 쓰기 직렬화 — 진행 중인 flush와 drop/eviction이 겹치지 않도록
+        self._sessions = OrderedDict()  # LRU 순 {sid: Session}
+        self._dirty = set()  # DB에 저장할 세션 id
+        self._pins = {}      # sid → 진행 중인 채팅 요청 수 (eviction/reap 제외)
+        self._bytes = 0      # 전체 세션 추정 바이트
+        self.evicted = 0     # 예산 초과로 내린 세션 수 (누적)
+        self.reaped = 0      # 유휴로 내린 세션 수 (누적)
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # 예산 초과 시 플러셔를 주기 전에 깨움
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    def _touch(self, sid, sess):
+        """(self._lock 안에서 호출) LRU 갱신"""
+        self._sessions.move_to_end(sid)
+        sess.used = time.monotonic()
+
+    def _account(self, sess):
+        """(self._lock 안에서 호출) 메시지 변경 후 추정 크기 재계산 — 예산 초과면 플러셔 깨움"""
+        size = _SESSION_OVERHEAD + sum(m.nbytes() for m in sess.messages)
+        self._bytes += size - sess.nbytes
+        sess.nbytes = size
+        if self._bytes > self.max_bytes:
+            self._wake.set()
 
     def get(self, sid):
         with self._lock:
-            return self._sessions.get(sid)
+            sess = self._sessions.get(sid)
+            if sess:
+                self._touch(sid, sess)
+            return sess
 
     def ensure(self, sid, title=""):
         with self._lock:
             # 기존 세션 확인
             if sid in self._sessions:
                 sess = self._sessions[sid]
+                self._touch(sid, sess)
                 # 만료 체크 (30분 경과)
-                if time.time() - sess["last_active"] > self.SESSION_TIMEOUT:
-                    print(f"[세션 만료] {sid} - {int((time.time() - sess['last_active']) / 60)}분 경과, 초기화", file=sys.stderr, flush=True)
-                    sess["messages"] = []
-                    sess["game"] = None
-                    sess["last_query"] = ""
-                    sess["last_active"] = time.time()
+                if time.time() - sess.last_active > self.SESSION_TIMEOUT:
+                    print(f"[세션 만료] {sid} - {int((time.time() - sess.last_active) / 60)}분 경과, 초기화", file=sys.stderr, flush=True)
+                    sess.messages = []
+                    sess.game = None
+                    sess.last_query = ""
+                    sess.last_active = time.time()
+                    sess.saved = 0
+                    sess.dropped = 0
+                    sess.replace = True
+                    self._account(sess)
                 return sess
             
             # 새 세션 생성
-            self._sessions[sid] = {
-                "game": None,
-                "last_query": "",
-                "messages": [],
-                "dirty": False,
-                "last_active": time.time(),
-                "title": title or sid,
-            }
-            return self._sessions[sid]
+            sess = self._sessions[sid] = Session(title or sid, time.time(), time.monotonic())
+            self._account(sess)
+            if len(self._sessions) > self.max_sessions:
+                self._wake.set()
+            return sess
 
     def add_message(self, sid, role, content, sources=None):
+        """role: Role, sources: "game/title" 리스트 (chunk id 튜플로 저장)"""
+        sources = source_ids(sources)
         with self._lock:
             sess = self._sessions.get(sid)
             if not sess:
                 return
             
             # 메시지 추가
-            sess["messages"].append({"role": role, "content": content, "sources": sources, "ts": time.time()})
+            sess.messages.append(Message(role, content, sources, time.time()))
             
             # 최대 메시지 수 제한
-            if len(sess["messages"]) > self.MAX_MESSAGES:
-                removed_count = len(sess["messages"]) - self.MAX_MESSAGES
-                sess["messages"] = sess["messages"][-self.MAX_MESSAGES:]
+            if len(sess.messages) > self.MAX_MESSAGES:
+                removed_count = len(sess.messages) - self.MAX_MESSAGES
+                sess.messages = sess.messages[-self.MAX_MESSAGES:]
+                sess.saved = max(0, sess.saved - removed_count)
+                sess.dropped += removed_count
+                sess.trimmed = True
                 print(f"[메시지 제한] {sid} - 오래된 {removed_count}개 메시지 제거", file=sys.stderr, flush=True)
             
-            # 활동 시간 업데이트
-            sess["last_active"] = time.time()
-            sess["dirty"] = True
-            sess["last_active"] = time.time()
-            # 타이머 리셋
-            if sid in self._timers:
-                self._timers[sid].cancel()
-            self._timers[sid] = threading.Timer(FLUSH_DELAY, self._flush_session, args=[sid])
-            self._timers[sid].daemon = True
-            self._timers[sid].start()
+            # 활동 시간 업데이트 (플러셔는 FLUSH_DELAY 동안 변경 없는 세션만 저장)
+            sess.last_active = time.time()
+            self._mark_dirty(sid, sess)
+            self._touch(sid, sess)
+            self._account(sess)
+
+    @contextmanager
+    def pinned(self, sid):
+        """채팅 요청 동안 세션을 메모리에 고정 — LLM 생성 중에 내려가서 답변 add_message가 버려지지 않도록
+        (아직 캐시에 없는 sid도 미리 고정 가능 — 요청 안에서 로드/생성)"""
+        with self._lock:
+            self._pins[sid] = self._pins.get(sid, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._pins[sid] == 1:
+                    del self._pins[sid]
+                else:
+                    self._pins[sid] -= 1
 
     def set_game(self, sid, game):
         with self._lock:
             sess = self._sessions.get(sid)
             if sess:
-                sess["game"] = game
+                sess.game = game
 
     def set_last_query(self, sid, query):
         with self._lock:
             sess = self._sessions.get(sid)
             if sess:
-                sess["last_query"] = query
+                sess.last_query = query
 
-    def get_history(self, sid, limit=4):
-        """최근 N개 메시지 반환 (메모리에서)"""
+    def set_title(self, sid, title):
+        with self._lock:
+            sess = self._sessions.get(sid)
+            if sess:
+                sess.title = title
+
+    def get_context(self, sid):
+        """(이전 게임, 이전 질문, 유저 메시지 수) 스냅샷 — 핸들러가 dict를 직접 읽지 않도록"""
         with self._lock:
             sess = self._sessions.get(sid)
             if not sess:
-                return []
-            return sess["messages"][-limit:]
+                return None, "", 0
+            user_count = sum(1 for m in sess.messages if m.role is Role.USER)
+            return sess.game, sess.last_query, user_count
 
-    def _flush_session(self, sid):
-        """세션 데이터를 DB에 저장"""
+    def reset(self, sid, notice):
+        """/clear — 메시지를 안내 문구 하나로 교체하고 게임/질문 컨텍스트 초기화
+        Returns: 캐시에 있던 세션이면 True (DB 반영은 flush(sids=[sid])로)"""
         with self._lock:
             sess = self._sessions.get(sid)
-            if not sess or not sess["dirty"]:
-                return
-            try:
-                conn = get_chat_conn()
-                # 세션 존재 확인, 없으면 생성
-                exists = conn.execute("SELECT id FROM sessions WHERE id=?", (sid,)).fetchone()
-                now = time.time()
-                if not exists:
-                    conn.execute("INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?,?,?,?)",
-                                 (sid, sess["title"], sess["messages"][0]["ts"] if sess["messages"] else now, now))
-                else:
-                    conn.execute("UPDATE sessions SET updated_at=?, title=? WHERE id=?", (now, sess["title"], sid))
-                # 기존 메시지 삭제 후 재삽입 (간단)
-                conn.execute("DELETE FROM messages WHERE session_id=?", (sid,))
-                for msg in sess["messages"]:
-                    conn.execute("INSERT INTO messages (session_id, role, content, sources, created_at) VALUES (?,?,?,?,?)",
-                                 (sid, msg["role"], msg["content"], json.dumps(msg["sources"]) if msg["sources"] else None, msg["ts"]))
-                conn.commit()
-                conn.close()
-                sess["dirty"] = False
-                print(f"[CACHE] 세션 {sid} DB 저장 완료 ({len(sess['messages'])}건)")
-            except Exception as e:
-                print(f"[CACHE] 세션 {sid} DB 저장 실패: {e}")
+            if sess:
+                sess.last_active = time.time()
+                sess.messages = [Message(Role.SYSTEM, notice, (), sess.last_active)]
+                sess.game = None
+                sess.last_query = ""
+                sess.saved = 0
+                sess.dropped = 0
+                sess.replace = True
+                self._mark_dirty(sid, sess)
+                self._account(sess)
+            return sess is not None
+
+    def drop(self, sid):
+        """캐시에서 세션 제거 (DB 삭제 시) — 진행 중인 flush가 끝난 뒤 제거해서 삭제된 세션이 되살아나지 않도록"""
+        with self._flush_lock:
+            with self._lock:
+                self._remove(sid)
+
+    def _remove(self, sid):
+        """(self._lock 안에서 호출) 메모리에서 세션 제거"""
+        sess = self._sessions.pop(sid, None)
+        if sess:
+            self._bytes -= sess.nbytes
+        self._dirty.discard(sid)
+
+    def get_history(self, sid, limit=HISTORY_MAX, block=HISTORY_BLOCK):
+        """현재 질문(마지막 메시지) 이전 대화 — 프롬프트 [이전 대화]용, 최대 limit개
+        오래된 쪽은 block개 단위로만 잘라냄 → 자르는 시점 사이에는 턴마다 뒤에 붙기만 해서
+        같은 세션 후속 질문의 프롬프트 앞부분(llama-server KV 캐시)이 그대로 유지됨"""
+        with self._lock:
+            sess = self._sessions.get(sid)
+            if not sess:
+                return []
+            # 세션 시작부터의 절대 위치로 계산 (MAX_MESSAGES로 앞이 잘려도 구간 경계가 매 턴 밀리지 않도록)
+            total = sess.dropped + len(sess.messages) - 1
+            start = 0 if total <= limit else -(-(total - limit) // block) * block
+            return sess.messages[max(start - sess.dropped, 0):-1]
+
+    def pending_sessions(self):
+        """아직 DB에 반영 안 된 세션 {sid: {"id", "title", "created_at", "updated_at"}} — 목록 조회 시 DB 행 대신 사용"""
+        with self._lock:
+            pending = {}
+            for sid in self._dirty:
+                sess = self._sessions[sid]
+                created = sess.messages[0].ts if sess.messages else sess.last_active
+                pending[sid] = {"id": sid, "title": sess.title, "created_at": created, "updated_at": sess.last_active}
+            return pending
+
+    def _mark_dirty(self, sid, sess):
+        """(self._lock 안에서 호출) 다음 flush 대상으로 표시"""
+        sess.dirty = True
+        self._dirty.add(sid)
+
+    def _flush_loop(self):
+        last_reap = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.flush(idle=FLUSH_DELAY)
+            if time.monotonic() - last_reap >= REAP_INTERVAL:
+                last_reap = time.monotonic()
+                self.reap()
+            self.evict()
+
+    def _evict(self, victims):
+        """(self._flush_lock 안에서 호출) victims [(sid, used), ...]를 DB에 저장한 뒤 메모리에서 제거 → 제거 수
+        저장 실패했거나 그 사이 다시 쓰인 세션은 남김"""
+        if not victims:
+            return 0
+        self._flush_locked(0, [sid for sid, _ in victims])
+        removed = 0
+        with self._lock:
+            for sid, used in victims:
+                sess = self._sessions.get(sid)
+                if sess is None or sess.dirty or sess.used != used or sid in self._pins:
+                    continue
+                self._remove(sid)
+                removed += 1
+        return removed
+
+    def evict(self):
+        """세션 수/바이트 예산 초과분을 LRU(오래 안 쓰인 순)로 내림 → 제거 수"""
+        with self._flush_lock:
+            with self._lock:
+                over_count = len(self._sessions) - self.max_sessions
+                over_bytes = self._bytes - self.max_bytes
+                victims = []
+                for sid, sess in self._sessions.items():  # 앞쪽이 LRU
+                    if over_count <= 0 and over_bytes <= 0:
+                        break
+                    if sid in self._pins:  # 답변 생성 중
+                        continue
+                    victims.append((sid, sess.used))
+                    over_count -= 1
+                    over_bytes -= sess.nbytes
+            removed = self._evict(victims)
+        if removed:
+            self.evicted += removed
+            print(f"[CACHE] 메모리 예산 초과 — 세션 {removed}개 내림 (남은 {len(self._sessions)}개, {self._bytes // 1024}KB)")
+        return removed
+
+    def reap(self):
+        """idle_evict초 넘게 대화가 없는 세션을 메모리에서 내림 → 제거 수"""
+        cutoff = time.time() - self.idle_evict
+        with self._flush_lock:
+            with self._lock:
+                victims = [(sid, sess.used) for sid, sess in self._sessions.items()
+                           if sess.last_active < cutoff and sid not in self._pins]
+            removed = self._evict(victims)
+        if removed:
+            self.reaped += removed
+            print(f"[CACHE] 유휴 세션 {removed}개 내림 (남은 {len(self._sessions)}개)")
+        return removed
+
+    def stats(self):
+        """{"sessions", "bytes", "dirty", "evicted", "reaped"}"""
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes, "dirty": len(self._dirty),
+                    "evicted": self.evicted, "reaped": self.reaped}
+
+    def flush(self, idle=0, sids=None):
+        """dirty 세션 중 idle초 이상 변경이 없는 것을 한 트랜잭션으로 DB에 저장 → 저장한 세션 수
+        sids: 지정하면 그 세션만 (idle 무시)
+        락 안에서는 스냅샷만 뜨고 SQLite I/O는 락 밖에서 (저장 중에도 다른 세션 요청이 막히지 않음)
+        아직 저장 안 된 메시지만 INSERT — 저장 중에 바뀐 세션은 다시 dirty가 되어 다음 flush에 반영"""
+        with self._flush_lock:
+            return self._flush_locked(idle, sids)
+
+    def _flush_locked(self, idle, sids):
+        """(self._flush_lock 안에서 호출) flush 본체"""
+        now = time.time()
+        snapshot = []  # (sid, title, created_at, updated_at, 새 메시지들, replace, trimmed, 남길 메시지 수)
+        with self._lock:
+            for sid in list(self._dirty) if sids is None else [sid for sid in sids if sid in self._dirty]:
+                sess = self._sessions[sid]
+                if sids is None and now - sess.last_active < idle:
+                    continue
+                messages = sess.messages
+                self._dirty.discard(sid)
+                snapshot.append((sid, sess.title, messages[0].ts if messages else now, sess.last_active,
+                                 messages[sess.saved:], sess.replace, sess.trimmed, len(messages)))
+                # 저장 성공을 가정하고 표시 (실패하면 replace로 통째로 다시 저장)
+                sess.dirty = False
+                sess.saved = len(messages)
+                sess.replace = sess.trimmed = False
+        if not snapshot:
+            return 0
+        # 메시지 → DB 행 (Message는 생성 후 바뀌지 않으므로 락 밖에서)
+        snapshot = [(sid, title, created, updated, [message_row(m) for m in new], replace, trimmed, keep)
+                    for sid, title, created, updated, new, replace, trimmed, keep in snapshot]
+        try:
+            chat_store.write_sessions(snapshot)
+        except Exception as e:
+            print(f"[CACHE] 세션 {len(snapshot)}개 DB 저장 실패: {e}")
+            with self._lock:
+                for sid, *_ in snapshot:
+                    sess = self._sessions.get(sid)
+                    if sess:
+                        sess.saved = 0
+                        sess.replace = True
+                        self._mark_dirty(sid, sess)
+            return 0
+        print(f"[CACHE] 세션 {len(snapshot)}개 DB 저장 완료 (새 메시지 {sum(len(s[4]) for s in snapshot)}건)")
+        return len(snapshot)
 
     def flush_all(self):
         """모든 dirty 세션 즉시 저장 (종료 시)"""
-        sids = list(self._sessions.keys())
-        for sid in sids:
-            self._flush_session(sid)
-        print(f"[CACHE] 전체 flush 완료 ({len(sids)}개 세션)")
+        self._stop.set()
+        self._wake.set()
+        count = self.flush()
+        print(f"[CACHE] 전체 flush 완료 ({count}개 세션)")
 
     def load_from_db(self, sid):
         """DB에서 기존 세션 로드 (서버 재시작 후 복원)"""
-        conn = get_chat_conn()
-        rows = conn.execute(
-            "SELECT role, content, sources, created_at FROM messages WHERE session_id=? ORDER BY created_at",
-            (sid,)
-        ).fetchall()
-        sess_row = conn.execute("SELECT title FROM sessions WHERE id=?", (sid,)).fetchone()
-        conn.close()
+        rows = chat_store.get_messages(sid)
         if rows:
-            sess = self.ensure(sid, title=sess_row[0] if sess_row else sid)
+            sess = self.ensure(sid, title=chat_store.get_title(sid) or sid)
             with self._lock:
-                sess["messages"] = [{"role": r, "content": c, "sources": json.loads(s) if s else None, "ts": t} for r, c, s, t in rows]
+                if sess.messages:
+                    # 다른 워커가 먼저 로드/추가한 경우 덮어쓰지 않음
+                    return sess
+                sess.messages = [Message(Role.parse(r), c, source_ids(json.loads(s)) if s else (), t) for r, c, s, t, _ in rows]
+                sess.saved = len(sess.messages)
+                self._account(sess)
                 # 이전 게임 추출
-                for msg in reversed(sess["messages"]):
-                    if msg["sources"]:
-                        src_str = str(msg["sources"]).lower()
-                        if "palworld" in src_str: sess["game"] = "palworld"; break
-                        elif "overwatch" in src_str: sess["game"] = "overwatch"; break
-                        elif "minecraft" in src_str: sess["game"] = "minecraft"; break
+                for msg in reversed(sess.messages):
+                    if msg.sources:
+                        src_str = str(source_names(msg.sources)).lower()
+                        if "palworld" in src_str: sess.game = "palworld"; break
+                        elif "overwatch" in src_str: sess.game = "overwatch"; break
+                        elif "minecraft" in src_str: sess.game = "minecraft"; break
             return sess
         return None
 
@@ -431,15 +651,45 @@ const sessionList = document.getElementById('sessionList');
 const emptyState = document.getElementById('emptyState');
 
 let currentSession = null;
+let sessions = [];          // 사이드바 목록 (첫 페이지 + 더 보기로 불러온 페이지)
+let sessionsNext = null;    // 다음 페이지 커서 (X-Next-Before)
+let sessionsEtag = null;    // 첫 페이지 ETag — 바뀐 게 없으면 서버가 304
+let sessionsMore = false;   // 더 보기로 이후 페이지를 불러왔는지 (폴링 갱신 시 유지)
 
 // 초기화
 loadSessions();
+setInterval(() => { if (!document.hidden) loadSessions(); }, 10000);  // 다른 탭/API 대화 반영 (대부분 304)
 
 input.addEventListener('keydown', e => { if (e.key === 'Enter') send(); });
 
 async function loadSessions() {
-  const r = await fetch('/api/sessions');
-  const sessions = await r.json();
+  const headers = sessionsEtag ? { 'If-None-Match': sessionsEtag } : {};
+  const r = await fetch('/api/sessions?limit=30', { headers, cache: 'no-store' });
+  if (r.status !== 304) {
+    const first = await r.json();
+    if (sessionsMore) {
+      // 새 첫 페이지 + 기존 목록의 나머지 (첫 페이지에서 밀려난 것 포함, 최신순 유지) — 커서도 그대로
+      const ids = new Set(first.map(s => s.id));
+      sessions = first.concat(sessions.filter(s => !ids.has(s.id)));
+    } else {
+      sessions = first;
+      sessionsNext = r.headers.get('X-Next-Before');
+    }
+    sessionsEtag = r.headers.get('ETag');
+  }
+  renderSessions();
+}
+
+async function loadMoreSessions() {
+  const r = await fetch(`/api/sessions?limit=30&before=${encodeURIComponent(sessionsNext)}`, { cache: 'no-store' });
+  const ids = new Set(sessions.map(s => s.id));
+  sessions = sessions.concat((await r.json()).filter(s => !ids.has(s.id)));
+  sessionsNext = r.headers.get('X-Next-Before');
+  sessionsMore = true;
+  renderSessions();
+}
+
+function renderSessions() {
   sessionList.innerHTML = '';
   sessions.forEach(s => {
     const div = document.createElement('div');
@@ -448,6 +698,14 @@ async function loadSessions() {
     div.onclick = () => loadSession(s.id);
     sessionList.appendChild(div);
   });
+  if (sessionsNext) {
+    const more = document.createElement('div');
+    more.className = 'session-item';
+    more.style.justifyContent = 'center';
+    more.textContent = '더 보기';
+    more.onclick = loadMoreSessions;
+    sessionList.appendChild(more);
+  }
 }
 
 async function newSession() {
@@ -489,6 +747,7 @@ async function loadSession(id) {
 async function deleteSession(id) {
   if (!confirm('이 대화를 삭제할까요?')) return;
   await fetch(`/api/sessions/${id}`, { method: 'DELETE' });
+  sessions = sessions.filter(s => s.id !== id);  // 더 보기 페이지에 있던 세션도 목록에서 제거
   if (currentSession === id) {
     currentSession = null;
     chat.innerHTML = '<div class="empty-state">게임에 대해 물어보세요! 🎮</div>';
@@ -530,12 +789,12 @@ async function send() {
   chat.scrollTop = chat.scrollHeight;
 
   try {
-    const r = await fetch('/api/chat', {
+    const r = await fetch('/api/chat/stream', {
       method: 'POST',
       headers: {'Content-Type': 'application/json'},
       body: JSON.stringify({ query: q, session_id: currentSession })
     });
-    const data = await r.json();
+    const data = await readStream(r, document.getElementById('loading'));
     document.getElementById('loading').remove();
 
     if (data.ask_game && data.games) {
@@ -564,6 +823,49 @@ async function send() {
   await loadSessions();
 }
 
+// SSE 스트림 읽기 — token 이벤트는 말풍선에 바로 표시, done 이벤트의 최종 답변 반환
+async function readStream(r, bubble) {
+  if (!r.ok) {
+    const err = await r.json().catch(() => ({}));
+    if (r.status === 503) throw new Error(`요청이 많습니다. ${err.retry_after || 5}초 후 다시 시도해주세요`);
+    throw new Error(err.message || `HTTP ${r.status}`);
+  }
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '', streamed = '', data = null;
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buf.indexOf('\\n\\n')) !== -1) {
+      const ev = parseSse(buf.slice(0, idx));
+      buf = buf.slice(idx + 2);
+      if (ev.event === 'sources') {
+        bubble.textContent = '✍️ 답변 작성 중...';
+      } else if (ev.event === 'token') {
+        streamed += ev.data.content;
+        bubble.classList.remove('loading');
+        bubble.innerHTML = esc(streamed);
+        chat.scrollTop = chat.scrollHeight;
+      } else if (ev.event === 'done') {
+        data = ev.data;
+      }
+    }
+  }
+  if (!data) throw new Error('응답 스트림이 중단되었습니다');
+  return data;
+}
+
+function parseSse(frame) {
+  let event = 'message', data = '';
+  frame.split('\\n').forEach(line => {
+    if (line.startsWith('event: ')) event = line.slice(7);
+    else if (line.startsWith('data: ')) data += line.slice(6);
+  });
+  return { event, data: data ? JSON.parse(data) : null };
+}
+
 function sendWithGame(game, originalQ) {
   input.value = game + ' ' + originalQ;
   send();
@@ -691,40 +993,19 @@ function mixColor(c1, c2, ratio) {
 })();
 </script>
 </body></html>"""
+PAGE = StaticPage(HTML)  # 요청마다 encode하지 않도록 시작 시 한 번 인코딩 + gzip/br 압축
 
 
-# ── 검색 상수 (모듈 레벨 — 매 요청마다 재생성 방지) ──
-RRF_K = 60  # Reciprocal Rank Fusion 파라미터
-
-INTENT_WEIGHTS = {
-    "stat":    (0.4, 0.6),  # 수치 질문 → BM25 우세 (키워드 정확도)
-    "howto":   (0.6, 0.4),  # 방법 질문 → Vector 우세 (의미론적)
-    "list":    (0.6, 0.4),  # 목록 질문 → Vector 우세
-    "compare": (0.6, 0.4),  # 비교 질문 → Vector 우세
-    "general": (0.6, 0.4),  # 일반 → Vector 우세 (의미론적 유사도 중시)
-}
+# ── 검색 파이프라인 (lazy load) ──
+retriever = None  # retrieval.Retriever — 전체/게임별 인덱스 + 제목 인덱스 + 검색 단계
+_db_lock = threading.Lock()  # 워커 스레드 동시 요청 시 인덱스 중복 로드 방지
+answer_cache = AnswerCache()  # 반복/유사 질문 → LLM 호출 생략
+llm_gate = LLMScheduler()  # llama-server 동시 호출 제한 + 대기열 (가득 차면 503)
+flights = SingleFlight()  # 동시에 들어온 같은 질문 → LLM 생성 1회
+metrics = Metrics()  # 단계별 지연 히스토그램 → GET /api/metrics
+request_log = RequestLog()  # 요청당 JSON 1줄 → log/requests.jsonl
+atexit.register(request_log.close)
 
-# ── 벡터 DB + BM25 ──
-db = None
-bm25_index = None
-bm25_docs = None
-
-def tokenize_ko(text):
-    """한국어 토크나이저 — 공백 분리 + 슬라이딩 바이그램으로 붙어쓰기 대응"""
-    text = text.lower()
-    raw_tokens = re.findall(r'[가-힣a-zA-Z0-9]+', text)
-    tokens = []
-    for t in raw_tokens:
-        if len(t) <= 5:
-            if len(t) >= 2:
-                tokens.append(t)
-        else:
-            tokens.append(t)
-            for i in range(len(t) - 1):
-                tokens.append(t[i:i+2])
-                if i + 3 <= len(t):
-                    tokens.append(t[i:i+3])
-    return tokens if tokens else raw_tokens
 
 def clean_answer(text):
     """답변 후처리: 중국어 제거, 반복 제거, 태그 제거"""
@@ -770,24 +1051,6 @@ def clean_answer(text):
             text = text[:last+1]
     return text.strip() or "잘 모르겠어요."
 
-def classify_intent(query):
-    """질문 의도 분류 — 검색 가중치 조절에 사용"""
-    stat_words = ["체력", "HP", "hp", "공격력", "방어력", "데미지", "스탯", "수치", "몇", "얼마"]
-    howto_words = ["어떻게", "방법", "하는법", "만드는법", "잡는법", "가는법", "공략", "팁", "가이드", "만들어"]
-    list_words = ["종류", "목록", "리스트", "뭐가있", "알려줘", "적성", "스킬", "드롭"]
-    compare_words = ["차이", "비교", "vs", "VS", "좋은", "강한", "약한", "추천"]
-
-    if any(w in query for w in stat_words):
-        return "stat"
-    if any(w in query for w in compare_words):
-        return "compare"
-    if any(w in query for w in howto_words):
-        return "howto"
-    if any(w in query for w in list_words):
-        return "list"
-    return "general"
-
-
 def rewrite_query(query, search_query):
     """쿼리 리라이트 — 검색에 최적화된 형태로 변환
     gamewiki 레퍼런스: 사용자 질문을 검색 키워드로 재구성"""
@@ -810,18 +1073,556 @@ def rewrite_query(query, search_query):
     return rewritten.strip()
 
 
-def get_db():
-    global db, bm25_index, bm25_docs
-    if db is None:
-        embeddings = HuggingFaceEmbeddings(model_name="jhgan/ko-sroberta-multitask")
-        db = FAISS.load_local(DB_DIR, embeddings, allow_dangerous_deserialization=True)
-        print("✅ 벡터DB 로드 완료")
-        all_docs = db.docstore._dict.values()
-        bm25_docs = list(all_docs)
-        corpus = [tokenize_ko(doc.page_content) for doc in bm25_docs]
-        bm25_index = BM25Okapi(corpus)
-        print(f"✅ BM25 인덱스 구축 완료 ({len(bm25_docs)}개 문서)")
-    return db
+def get_retriever():
+    """검색 파이프라인 lazy load (스레드 안전)"""
+    global retriever
+    if retriever is None:
+        with _db_lock:
+            if retriever is None:
+                embeddings = CachedEmbeddings(HuggingFaceEmbeddings(model_name="jhgan/ko-sroberta-multitask"))
+                retriever = Retriever(DB_DIR, embeddings, workers=MAX_WORKERS)
+    return retriever
+
+
+def subquery_game_filter(query, sq):
+    """서브쿼리별 게임 필터: 원본 쿼리에서 엔티티 직전에 등장한 가장 가까운 게임명 탐색
+    (다중 게임 쿼리 대응: "팰월드 람볼이랑 오버워치 리퍼" → 각각 분리)"""
+    q_lower = query.lower()
+    sq_pos = q_lower.find(sq.lower())
+    if sq_pos == -1:
+        return None
+    before = q_lower[:sq_pos]  # 엔티티 이전 텍스트
+    _gmap = {
+        "palworld":   ["팰월드", "palworld"],
+        "overwatch":  ["오버워치", "overwatch", "옵치"],
+        "minecraft":  ["마인크래프트", "마크", "minecraft"],
+    }
+    best_pos, best_game = -1, None
+    for gname, kws in _gmap.items():
+        for kw in kws:
+            p = before.rfind(kw)  # 엔티티 앞에서 가장 가까운(오른쪽) 게임명
+            if p > best_pos:
+                best_pos, best_game = p, gname
+    return best_game
+
+
+def chat_session_id(body):
+    """요청 본문의 session_id (없으면 새로 만들어 본문에 넣음 — 핸들러의 세션 고정과 prepare_chat이 같은 id 사용)"""
+    if not body.get("session_id"):
+        body["session_id"] = str(uuid.uuid4())[:8]
+    return body["session_id"]
+
+
+def prepare_chat(body, trace):
+    """/api/chat 공통 준비 단계 — 세션 확보, 검색, 프롬프트 구성까지
+    Returns: plan dict. LLM 호출 없이 바로 응답할 경우 plan["response"]에 응답 본문
+    (일반/스트리밍 엔드포인트가 같은 plan으로 LLM 호출 방식만 달리함)
+    trace: 단계별 소요 시간 기록 (metrics.Trace, plan["trace"]로 이어짐)"""
+    query = body.get("query", "")
+    session_id = chat_session_id(body)
+
+    # 오타 감지 (자동 보정하지 않고 제안)
+    with trace.span("typo"):
+        fixed_query, typo_fixed = fix_typo(query, threshold=0.5)  # 한글 유사도 낮춤
+    typo_suggestion = None
+    if typo_fixed:
+        print(f"[오타 감지] '{query}' (추천: '{fixed_query}')")
+        typo_suggestion = fixed_query
+
+    # 캐시에 세션 확보 (없으면 DB에서 로드 시도)
+    if not cache.get(session_id):
+        if not cache.load_from_db(session_id):
+            cache.ensure(session_id, title=query[:30])
+
+    # 유저 메시지를 캐시에 저장 (DB는 나중에 자동 flush)
+    cache.add_message(session_id, Role.USER, query)
+
+    # 세션 컨텍스트 스냅샷 (다른 요청이 동시에 같은 세션을 수정할 수 있음)
+    prev_game, prev_query, user_count = cache.get_context(session_id)
+
+    # 첫 메시지면 제목 업데이트
+    if user_count == 1:
+        cache.set_title(session_id, query[:30] + ("..." if len(query) > 30 else ""))
+
+    # 쿼리 정규화 (붙여쓰기 → 띄어쓰기 동의어)
+    t0 = time.perf_counter()
+    QUERY_SYNONYMS = {
+        "엔더드래곤": "엔더 드래곤",
+        "엔더진주": "엔더 진주",
+        "엔더맨": "엔더맨",
+        "위더스켈레톤": "위더 스켈레톤",
+        "네더라이트": "네더라이트",
+        "레드스톤": "레드스톤",
+        "솔저76": "솔저: 76",
+        "정크랫": "정크랫",
+        # 동의어 확장 (검색 정확도 향상)
+        "체력": "생명력",
+        "공격력": "공격력",
+        "피통": "생명력",
+        "HP": "생명력",
+        "hp": "생명력",
+    }
+    search_query = query
+    for old, new in QUERY_SYNONYMS.items():
+        if old in search_query and old != new:
+            search_query = search_query.replace(old, new)
+    # 쿼리 리라이트 (불용어 제거 + 게임명 확장)
+    search_query = rewrite_query(query, search_query)
+
+    # 게임명 감지
+    game_filter = None
+    query_lower = query.lower()
+    if any(kw in query_lower for kw in ["팰월드", "palworld", "팰"]):
+        game_filter = "palworld"
+    elif any(kw in query_lower for kw in ["오버워치", "overwatch", "옵치"]):
+        game_filter = "overwatch"
+    elif any(kw in query_lower for kw in ["마인크래프트", "마크", "minecraft"]):
+        game_filter = "minecraft"
+
+    # 게임 필터 없으면 캐시에서 이전 게임 컨텍스트 사용
+    if not game_filter and prev_game:
+        game_filter = prev_game
+    trace.info.update(session_id=session_id, query=query, game=game_filter, typo_suggestion=typo_suggestion)
+
+    # 후속 질문이면 이전 질문을 검색 쿼리에 합침 (캐시에서)
+    follow_up_markers = ["자세", "더", "그거", "그것", "알려", "뭐야", "어때"]
+    if session_id and len(query) < 20 and any(m in query for m in follow_up_markers):
+        if prev_query:
+            search_query = prev_query + " " + search_query
+    trace.add("rewrite", (time.perf_counter() - t0) * 1000)
+
+    # ── 검색 파이프라인 (lazy load) ──
+    pipeline = get_retriever()
+
+    # ── 멀티스텝 추론: 복합 질문 감지 (원본 query 사용) ──
+    is_complex, query_type, subqueries = detect_complex_query(query)
+
+    if is_complex and len(subqueries) >= 2:
+        # 서브쿼리별 게임 필터 → 임베딩 1회 배치 + 파티션별 FAISS 배치 검색, BM25도 같은 단계에서
+        subqueries = subqueries[:3]  # 최대 3개까지
+        sq_games = [subquery_game_filter(query, sq) or game_filter for sq in subqueries]  # 감지 실패 시 전체 쿼리 필터
+        # 서브쿼리는 제목 정확 매칭만 부스트, 문맥 부스트 없음
+        sq_results = pipeline.search_batch(subqueries, 10, sq_games, title_boost={TITLE_EXACT: 10.0}, context=False)
+        # leg 시간은 배치 전체라 한 번만, RRF/부스트는 서브쿼리별 합산
+        trace.add_timings(sq_results[0].timings)
+        for sq_result in sq_results[1:]:
+            trace.add("fusion", sq_result.timings["fusion_ms"])
+            trace.add("boost", sq_result.timings["boost_ms"])
+
+        subquery_results = []
+        for sq, sq_result in zip(subqueries, sq_results):
+            sq_docs = sq_result.docs(3)  # 서브쿼리당 3개
+
+            # sources 수집
+            sq_sources = []
+            for doc in sq_docs:
+                game = doc.metadata.get("game", "")
+                title = doc.metadata.get("title", "")
+                src = f"{game}/{title}"
+                if src not in sq_sources:
+                    sq_sources.append(src)
+
+            subquery_results.append((sq, sq_docs, sq_sources))
+
+        # 결과 통합 + 멀티스텝 프롬프트
+        with trace.span("prompt"):
+            context, sources = merge_results(subquery_results, query_type)
+            prompt = build_multi_step_prompt(query, context, query_type)
+
+        payload = {
+            "prompt": prompt,
+            "n_predict": 300,  # 복합 질문이라 더 긴 답변
+            "temperature": 0.01,
+            "repeat_penalty": 1.2,
+            "top_p": 0.9,
+            "top_k": 30,
+            # 멀티스텝: "[" 제거 (LLM이 [리퍼], [겐지] 헤더로 답변 시작 허용)
+            # "\n\n\n" 사용 (비교 답변의 \n\n 단락 구분 허용)
+            "stop": ["\n\n\n", "질문:", "참고:", "---", "```", "根据", "抱歉", "Sorry"],
+            **llm_client.cache_params(),  # 슬롯은 대기열 통과 시 배정
+        }
+
+        plan = {"mode": "multi", "query": query, "session_id": session_id, "game_filter": game_filter,
+                "sources": sources, "payload": payload, "timeout": 90, "trace": trace,
+                "flight_key": ("multi", normalize_query(query), game_filter)}
+        # 멀티스텝 프롬프트에는 이전 대화가 들어가지 않으므로 항상 캐시 조회
+        sq_chunk_ids = [doc.metadata["chunk_id"] for _, sq_docs, _ in subquery_results for doc in sq_docs]
+        trace.info.update(mode="multi", query_type=query_type, subqueries=subqueries, sq_games=sq_games,
+                          chunk_ids=sq_chunk_ids, sources=sources)
+        hit = lookup_answer(plan, query, sq_chunk_ids)
+        return {"response": hit} if hit else plan
+
+    # ── 의도 분류 ──
+    intent = classify_intent(search_query)
+
+    # ── 하이브리드 검색 + RRF (Reciprocal Rank Fusion) + 제목/문맥 부스트 ──
+    # game_filter가 있으면 해당 게임 파티션만 검색 (벡터 결과가 없으면 전체로 fallback)
+    result = pipeline.search(search_query, 20, game_filter, intent)
+    trace.add_timings(result.timings)
+
+    # ── 검색 품질 평가 + 재검색 ── (품질은 RRF + 제목 부스트 기준)
+    quality_score = calculate_search_quality(result.fused()[:10], search_query, {h.chunk_id: h.rrf + h.title for h in result.hits})
+    trace.info.update(mode="single", search_query=search_query, intent=intent, quality=round(quality_score, 3))
+
+    # 품질이 낮으면 쿼리 확장 후 재검색
+    if should_retry_search(quality_score, threshold=0.15):
+        expanded_query = expand_query_for_retry(search_query)
+
+        # 재검색
+        retry = pipeline.search(expanded_query, 20, game_filter, intent)
+        trace.add_timings(retry.timings)
+
+        # 재검색 품질 체크 — 더 좋으면 교체
+        retry_quality = calculate_search_quality(retry.fused()[:10], expanded_query, {h.chunk_id: h.rrf + h.title for h in retry.hits})
+        trace.info["retry"] = {"query": expanded_query, "quality": round(retry_quality, 3), "adopted": retry_quality > quality_score}
+        if retry_quality > quality_score:
+            result = retry
+
+    # RRF + 부스트 점수 기준 정렬
+    results = result.docs()
+
+    # 의도별 chunk 수 조절 (컨텍스트 압축)
+    # 너무 많은 문서를 넣으면 지연/품질 저하가 발생하므로 축소
+    if intent == "stat":
+        n_chunks = 3
+    elif intent in ("howto", "list", "compare"):
+        n_chunks = 4
+    else:
+        n_chunks = 4
+    if game_filter:
+        results = [d for d in results if d.metadata.get("game", "") == game_filter][:n_chunks]
+    else:
+        found_games = set()
+        for doc in results:
+            g = doc.metadata.get("game", "")
+            if g:
+                found_games.add(g)
+        if len(found_games) >= 2:
+            game_names = {"palworld": "팰월드", "overwatch": "오버워치", "minecraft": "마인크래프트"}
+            game_list = [game_names.get(g, g) for g in sorted(found_games)]
+            ask_msg = f"'{query}'은(는) 여러 게임에 존재합니다. 어떤 게임에 대해 알고 싶으신가요?"
+            cache.add_message(session_id, Role.ASSISTANT, ask_msg)
+            cache.set_last_query(session_id, query)
+            trace.outcome = "ask_game"
+            return {"response": {"answer": ask_msg, "sources": [], "ask_game": True, "games": game_list, "session_id": session_id}}
+        results = results[:n_chunks]
+
+    t0 = time.perf_counter()
+    context = ""
+    sources = []
+    for doc in results:
+        game = doc.metadata.get("game", "")
+        title = doc.metadata.get("title", "")
+        chunk = doc.page_content[:450]  # 컨텍스트 압축 (속도/정확도 균형)
+        context += f"\n[{title}]\n{chunk}\n"
+        src = f"{game}/{title}"
+        if src not in sources:
+            sources.append(src)
+    trace.info.update(chunk_ids=[doc.metadata["chunk_id"] for doc in results], sources=sources, context_len=len(context))
+
+    # 이전 대화 컨텍스트 (캐시에서, 현재 질문 제외)
+    history = ""
+    for msg in cache.get_history(session_id):
+        if msg.role is Role.USER:
+            history += f"사용자: {msg.content}\n"
+        elif msg.role is Role.ASSISTANT:
+            history += f"답변: {msg.content}\n"
+
+    # LLM - 질문 형태 보정
+    llm_query = query
+    question_markers = ["?", "？", "뭐", "어떻게", "알려", "설명", "가르쳐", "어디", "언제", "누가", "왜"]
+    if not any(m in query for m in question_markers):
+        llm_query = f"{query}에 대해 알려줘"
+
+    prompt = build_prompt(context, llm_query, history)
+    trace.add("prompt", (time.perf_counter() - t0) * 1000)
+
+    payload = {
+        "prompt": prompt,
+        "n_predict": 200,
+        "temperature": 0.01,
+        "repeat_penalty": 1.2,
+        "top_p": 0.9,
+        "top_k": 30,
+        "stop": ["\n\n", "질문:", "참고:", "---", "```", "[", "根据", "抱歉", "Sorry"],
+        **llm_client.cache_params(),  # 슬롯은 대기열 통과 시 배정
+    }
+
+    plan = {"mode": "single", "query": query, "session_id": session_id, "game_filter": game_filter,
+            "sources": sources, "payload": payload, "timeout": 60, "trace": trace,
+            "typo_suggestion": typo_suggestion, "follow_up": len(query) < 20 and any(m in query for m in follow_up_markers),
+            # 요청 병합 키 — 대화 지문에 검색 쿼리도 포함 (후속 질문은 이전 질문이 검색어에 합쳐짐)
+            "flight_key": ("single", normalize_query(query), game_filter,
+                           hashlib.sha1(f"{history}\0{search_query}".encode()).hexdigest())}
+    # 이전 대화가 프롬프트에 들어가면 같은 질문도 답이 달라지므로 캐시 생략
+    if not history:
+        hit = lookup_answer(plan, search_query, [doc.metadata["chunk_id"] for doc in results])
+        if hit:
+            return {"response": hit}
+    return plan
+
+
+def lookup_answer(plan, text, chunk_ids):
+    """답변 캐시 조회 — hit이면 세션에 기록한 응답 본문, miss면 None (plan["cache"]에 저장용 키를 남김)
+    text: 근사 매칭용으로 임베딩할 질문 (검색에서 이미 임베딩한 문자열이면 임베딩 캐시 hit)"""
+    pipeline = get_retriever()
+    vector = pipeline.embeddings.embed_query(text)
+    plan["cache"] = (plan["query"], plan["game_filter"], chunk_ids, vector)
+    hit = answer_cache.get(*plan["cache"])
+    if hit is None:
+        return None
+    print(f"💾 답변 캐시 hit: '{plan['query']}' (hit_rate={answer_cache.stats()['hit_rate']:.0%})", file=sys.stderr, flush=True)
+    plan["trace"].outcome = "cached"
+    return dict(record_answer(plan, hit["answer"], hit["sources"]), cached=True)
+
+
+def typo_retry(query, typo_suggestion, answer, sources, game=None, deadline=None):
+    """오타 제안 + 재검색 (검색 실패 시) — (answer, sources) 반환
+    game: 원래 질문의 게임 필터 (재검색도 같은 파티션에서)
+    deadline: 원래 요청의 마감 (time.monotonic 기준) — 재검색 LLM 호출은 대기열을 거쳐 남은 시간 안에서만"""
+    # 오타 제안 + 재검색 (검색 실패 시)
+    needs_retry = False
+    if typo_suggestion:
+        if not sources or len(sources) == 0:
+            needs_retry = True
+        elif "참고자료에" in answer and ("없습니다" in answer or "찾을 수 없습니다" in answer):
+            needs_retry = True
+
+    if needs_retry:
+        print(f"[오타 재검색] '{query}' → '{typo_suggestion}'", file=sys.stderr, flush=True)
+
+        # 보정된 쿼리로 재검색 (원래 질문의 게임 필터 유지)
+        retry_results = get_retriever().search(typo_suggestion, 15, game).docs(3)
+
+        # 재검색 결과가 있으면
+        if retry_results and len(retry_results) > 0:
+            retry_context = ""
+            retry_sources = []
+            for doc in retry_results:
+                game = doc.metadata.get("game", "")
+                title = doc.metadata.get("title", "")
+                chunk = doc.page_content[:350]
+                retry_context += f"\n[{title}]\n{chunk}\n"
+                src = f"{game}/{title}"
+                if src not in retry_sources:
+                    retry_sources.append(src)
+
+            # 재검색 LLM 질의
+            retry_llm_query = f"{typo_suggestion}에 대해 알려줘"
+            retry_prompt = build_prompt(retry_context, retry_llm_query)
+            retry_payload = {
+                "prompt": retry_prompt,
+                "n_predict": 200,
+                "temperature": 0.01,
+                "repeat_penalty": 1.2,
+                "top_p": 0.9,
+                "top_k": 30,
+                "stop": ["\n\n", "질문:", "참고:", "---", "```", "[", "根据", "抱歉", "Sorry"],
+                **llm_client.cache_params(),
+            }
+            remaining = 60 if deadline is None else deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise Overloaded("요청 마감 시간 초과", 1)
+                # 재검색도 LLM 호출이므로 슬롯을 받아서 (대기열이 차 있으면 제안만)
+                with llm_gate.admit() as ticket:
+                    waited = ticket.wait(remaining)
+                    retry_payload.update(llm_client.cache_params(ticket.slot))
+                    retry_result = llm_client.complete(LLAMA_URL, retry_payload, timeout=remaining - waited)
+                retry_answer = retry_result.get("content", "").strip() or "응답을 생성할 수 없습니다."
+                retry_answer = clean_answer(retry_answer)
+                print(f"[재검색 답변] '{retry_answer[:100]}'", file=sys.stderr, flush=True)
+
+                # 재검색 성공 → 제안 메시지 + 재검색 결과
+                answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n{retry_answer}"
+                sources = retry_sources
+                print(f"[재검색 성공] sources: {retry_sources}", file=sys.stderr, flush=True)
+            except Overloaded as e:
+                print(f"[재검색 생략] {e}", file=sys.stderr, flush=True)
+                answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n" + answer
+            except Exception as e:
+                print(f"[재검색 LLM 오류] {e}", file=sys.stderr, flush=True)
+                answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n" + answer
+        else:
+            # 재검색도 실패
+            answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n" + answer
+
+    return answer, sources
+
+
+def finish_chat(plan, raw_answer, error=None):
+    """LLM 원문 답변 후처리 — 정리/검증/오타 재검색 + 답변 캐시 저장 → (answer, sources)
+    세션 기록은 record_answer()로 따로 (병합된 요청들이 각자 자기 세션에 기록)"""
+    query = plan["query"]
+    sources = plan["sources"]
+    multi = plan["mode"] == "multi"
+    if error is not None:
+        answer = f"LLM 오류: {error}"
+        plan["trace"].outcome = "error"
+        plan["trace"].info["error"] = str(error)
+    else:
+        with plan["trace"].span("validate"):
+            answer = raw_answer.strip() or "응답을 생성할 수 없습니다."
+            # 후처리: 중국어 제거, 반복 제거, 태그 제거
+            answer = clean_answer(answer)
+
+            # ── 답변 검증 ──
+            is_valid, confidence, issues = validate_answer(answer, query, sources)
+        plan["trace"].info.update(valid=is_valid, confidence=round(confidence, 2), issues=issues)
+
+        if not is_valid and confidence < 0.3:
+            # 신뢰도 매우 낮음 → 경고 추가
+            answer = f"⚠️ 답변 신뢰도가 낮습니다 ({int(confidence*100)}%).\n\n{answer}"
+
+    if not multi and plan["typo_suggestion"]:
+        answer, sources = typo_retry(query, plan["typo_suggestion"], answer, sources, plan["game_filter"], plan.get("deadline"))
+
+    # 답변 캐시 저장 (LLM 오류/저신뢰 답변은 제외)
+    if plan.get("cache") and error is None and (is_valid or confidence >= 0.3):
+        answer_cache.put(*plan["cache"], answer, sources)
+
+    return answer, sources
+
+
+def record_answer(plan, answer, sources):
+    """봇 답변을 세션 캐시에 기록 → 응답 본문"""
+    query = plan["query"]
+    session_id = plan["session_id"]
+    multi = plan["mode"] == "multi"
+    plan["trace"].info["answer_len"] = len(answer)
+    # 봇 메시지를 캐시에 저장 + 게임/쿼리 컨텍스트 업데이트
+    cache.add_message(session_id, Role.ASSISTANT, answer, sources=sources)
+    if plan["game_filter"]:
+        cache.set_game(session_id, plan["game_filter"])
+    # last_query는 의미있는 질문만 저장 (후속 질문이면 유지)
+    if multi or not plan["follow_up"]:
+        cache.set_last_query(session_id, query)
+
+    return {"answer": answer, "sources": sources, "session_id": session_id}
+
+
+def log_request(trace):
+    """끝난 요청 → 지연 히스토그램 + 요청 로그(JSONL) + stderr 요약 1줄"""
+    metrics.record(trace)
+    info = trace.info
+    record = {
+        "ts": round(time.time(), 3),
+        "endpoint": trace.endpoint,
+        "outcome": trace.outcome,
+        "total_ms": round(trace.elapsed_ms(), 1),
+        "stages": {stage: round(ms, 1) for stage, ms in trace.stages.items()},
+        **info,
+    }
+    request_log.write(record)
+    stages = " ".join(f"{stage}={ms:.0f}ms" for stage, ms in trace.stages.items())
+    extra = ""
+    if "quality" in info:
+        extra += f" quality={info['quality']:.2f}"
+    if "confidence" in info:
+        extra += f" conf={info['confidence']:.2f}"
+    print(f"📝 [{trace.endpoint}] {trace.outcome} {record['total_ms']:.0f}ms '{info.get('query', '')}' "
+          f"intent={info.get('intent', info.get('mode', '-'))} game={info.get('game')}{extra} | {stages}",
+          file=sys.stderr, flush=True)
+
+
+def metric_gauges():
+    """/api/metrics용 호출 시점 값 — 캐시 적중률, LLM 대기열, 요청 병합"""
+    gate = llm_gate.stats()
+    answers = answer_cache.stats()
+    gauges = [
+        ("llm_active", "gauge", "LLM 호출 중인 요청 수", gate["active"]),
+        ("llm_queue_depth", "gauge", "LLM 슬롯 대기 중인 요청 수", gate["queued"]),
+        ("llm_pending", "gauge", "입장 후 아직 슬롯이 없는 요청 수", gate["pending"]),
+        ("llm_concurrency_limit", "gauge", "LLM 동시 호출 제한", gate["limit"]),
+        ("llm_rejected_total", "counter", "LLM 대기열 거절 수 (503)", gate["rejected"]),
+        ("answer_cache_size", "gauge", "답변 캐시 항목 수", answers["size"]),
+        ("answer_cache_hits_total", "counter", "답변 캐시 hit 수", answers["hits"]),
+        ("answer_cache_misses_total", "counter", "답변 캐시 miss 수", answers["misses"]),
+        ("answer_cache_hit_ratio", "gauge", "답변 캐시 적중률", f"{answers['hit_rate']:.4f}"),
+        ("flights_in_progress", "gauge", "진행 중인 LLM 생성 (병합 키 기준)", flights.in_flight()),
+        ("flights_shared_total", "counter", "다른 요청의 생성 결과를 받은 요청 수", flights.shared),
+    ]
+    sessions = cache.stats()
+    gauges += [
+        ("session_cache_sessions", "gauge", "메모리에 있는 세션 수", sessions["sessions"]),
+        ("session_cache_bytes", "gauge", "세션 캐시 추정 메모리 (바이트)", sessions["bytes"]),
+        ("session_cache_dirty", "gauge", "DB 저장 대기 중인 세션 수", sessions["dirty"]),
+        ("session_cache_evicted_total", "counter", "메모리 예산 초과로 내린 세션 수", sessions["evicted"]),
+        ("session_cache_reaped_total", "counter", "유휴로 내린 세션 수", sessions["reaped"]),
+    ]
+    if retriever is not None:
+        emb = retriever.embeddings.stats()
+        gauges += [
+            ("embed_cache_size", "gauge", "쿼리 임베딩 캐시 항목 수", emb["size"]),
+            ("embed_cache_hits_total", "counter", "쿼리 임베딩 캐시 hit 수", emb["hits"]),
+            ("embed_cache_misses_total", "counter", "쿼리 임베딩 캐시 miss 수", emb["misses"]),
+            ("embed_cache_hit_ratio", "gauge", "쿼리 임베딩 캐시 적중률", f"{emb['hit_rate']:.4f}"),
+        ]
+    return gauges
+
+
+def page_limit(query, page):
+    """?limit= 파싱 — page: (기본, 최대), 숫자가 아니거나 1 미만이면 ValueError"""
+    default, maximum = page
+    limit = int(query.get("limit", [default])[0])
+    if limit < 1:
+        raise ValueError(f"limit={limit}")
+    return min(limit, maximum)
+
+
+def sessions_page(limit, before=None):
+    """세션 목록 1페이지 (최근 대화 순) → (세션들, 다음 페이지 커서 또는 None)
+    DB 페이지에 아직 저장 안 된 캐시 세션(새 세션, 제목/순서 변경)을 덮어씀
+    before: 이전 응답의 커서 "updated_at:id" """
+    cursor = None
+    if before:
+        updated, sid = before.split(":", 1)
+        cursor = (float(updated), sid)
+    pending = cache.pending_sessions()
+    # 캐시 세션의 DB 행은 빠지고 위치가 바뀌므로 그만큼 더 읽음 (+1: 다음 페이지 유무)
+    rows = [r for r in chat_store.list_sessions(limit + len(pending) + 1, cursor) if r["id"] not in pending]
+    rows += [p for p in pending.values() if cursor is None or (p["updated_at"], p["id"]) < cursor]
+    rows.sort(key=lambda r: (r["updated_at"], r["id"]), reverse=True)
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], f"{last['updated_at']!r}:{last['id']}"
+
+
+def messages_page(sid, limit, before=None):
+    """세션 메시지 1페이지 (시간순, 최근 limit개) → (메시지들, 더 이전 페이지 커서 또는 None)
+    before: 이전 응답의 커서 "created_at:id" """
+    cursor = None
+    if before:
+        created, mid = before.split(":", 1)
+        cursor = (float(created), int(mid))
+    # 캐시에만 있는 새 메시지는 DB id가 없으므로 이 세션만 먼저 저장 (dirty가 아니면 아무것도 안 함)
+    cache.flush(sids=[sid])
+    rows = chat_store.get_messages(sid, limit + 1, cursor)
+    more = len(rows) > limit
+    if more:
+        rows = rows[1:]
+    msgs = [{"role": r, "content": c, "sources": s} for r, c, s, _, _ in rows]
+    return msgs, f"{rows[0][3]!r}:{rows[0][4]}" if more else None
+
+
+def stream_llm(payload, timeout, final=None):
+    """llama-server 스트리밍 모드 — 토큰 조각을 도착하는 대로 yield
+    final: 주어지면 마지막(stop) 청크로 채움 (토큰 수 등)"""
+    payload = dict(payload, stream=True)
+    with llm_client.post(LLAMA_URL, payload, timeout, stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            chunk = json.loads(line[6:])
+            if chunk.get("content"):
+                yield chunk["content"]
+            if chunk.get("stop"):
+                if final is not None:
+                    final.update(chunk)
+                break
+
 
 
 # ── 핸들러 ──
@@ -842,618 +1643,299 @@ class Handler(BaseHTTPRequestHandler):
         return True
 
     def do_GET(self):
-        if self.path == '/api/sessions':
-            conn = get_chat_conn()
-            rows = conn.execute("SELECT id, title, created_at, updated_at FROM sessions ORDER BY updated_at DESC").fetchall()
-            conn.close()
-            sessions = [{"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3]} for r in rows]
-            self._json(sessions)
-        elif self.path.startswith('/api/sessions/') and self.path.endswith('/messages'):
-            sid = self.path.split('/')[3]
-            conn = get_chat_conn()
-            rows = conn.execute("SELECT role, content, sources FROM messages WHERE session_id=? ORDER BY created_at", (sid,)).fetchall()
-            conn.close()
-            msgs = [{"role": r[0], "content": r[1], "sources": r[2]} for r in rows]
-            self._json(msgs)
-        else:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/api/sessions' or url.path.startswith('/api/sessions/') and url.path.endswith('/messages'):
+            # ?limit=&before= 커서 페이지 — 다음 페이지 커서는 X-Next-Before 헤더로
+            try:
+                before = query.get("before", [None])[0]
+                if url.path == '/api/sessions':
+                    page, cursor = sessions_page(page_limit(query, SESSION_PAGE), before)
+                else:
+                    page, cursor = messages_page(url.path.split('/')[3], page_limit(query, MESSAGE_PAGE), before)
+            except ValueError as e:
+                self._json({"error": f"잘못된 페이지 파라미터: {e}"}, 400)
+                return
+            self._json_etag(page, {"X-Next-Before": cursor} if cursor else None)
+        elif url.path == '/api/metrics':
+            body = metrics.render(metric_gauges()).encode()
             self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            status, headers, body = PAGE.response(self.headers.get("Accept-Encoding"), self.headers.get("If-None-Match"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
             self.end_headers()
-            self.wfile.write(HTML.encode())
+            self.wfile.write(body)
 
     def do_POST(self):
         length = int(self.headers.get("Content-Length", 0))
         body = json.loads(self.rfile.read(length)) if length > 0 else {}
 
         if self.path == '/api/sessions':
-            # 새 세션 생성 (최대 10개 제한, FIFO queue)
-            conn = get_chat_conn()
-            
-            # 현재 세션 개수 확인
-            count = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
-            
-            # 10개 이상이면 가장 오래된 것 삭제
-            if count >= 10:
-                oldest = conn.execute("SELECT id FROM sessions ORDER BY created_at ASC LIMIT 1").fetchone()
-                if oldest:
-                    old_id = oldest[0]
-                    conn.execute("DELETE FROM messages WHERE session_id=?", (old_id,))
-                    conn.execute("DELETE FROM sessions WHERE id=?", (old_id,))
-                    # 캐시에서도 제거
-                    with cache._lock:
-                        cache._sessions.pop(old_id, None)
-            
-            # 새 세션 생성
+            # 새 세션 생성 (최대 10개 제한, FIFO queue — 10개 이상이면 가장 오래된 것 삭제)
             sid = str(uuid.uuid4())[:8]
-            now = time.time()
-            conn.execute("INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?,?,?,?)",
-                         (sid, "새 대화", now, now))
-            conn.commit()
-            conn.close()
+            old_id = chat_store.create_session(sid, "새 대화", time.time())
+            if old_id:
+                cache.drop(old_id)  # 캐시에서도 제거
             self._json({"id": sid, "title": "새 대화"})
 
         elif self.path.startswith('/api/sessions/') and self.path.endswith('/clear'):
             sid = self.path.split('/')[3]
-            # 캐시 초기화
-            sess = cache.get(sid)
-            if sess:
-                with cache._lock:
-                    sess["messages"] = [{"role": "system", "content": "컨텍스트가 초기화되었습니다.", "sources": None, "ts": time.time()}]
-                    sess["game"] = None
-                    sess["last_query"] = ""
-                    sess["dirty"] = True
-            # DB도 즉시 정리
-            conn = get_chat_conn()
-            conn.execute("DELETE FROM messages WHERE session_id=?", (sid,))
-            now = time.time()
-            conn.execute("INSERT INTO messages (session_id, role, content, sources, created_at) VALUES (?,?,?,?,?)",
-                         (sid, "system", "컨텍스트가 초기화되었습니다.", None, now))
-            conn.execute("UPDATE sessions SET updated_at=? WHERE id=?", (now, sid))
-            conn.commit()
-            conn.close()
+            # 캐시 초기화 + DB도 즉시 정리 (캐시에 있으면 flush가 메시지를 통째로 교체)
+            if cache.reset(sid, "컨텍스트가 초기화되었습니다."):
+                cache.flush(sids=[sid])
+            else:
+                chat_store.clear_session(sid, "컨텍스트가 초기화되었습니다.", time.time())
             self._json({"ok": True})
 
         elif self.path == '/api/chat':
             # API 키 검증 (외부 API 호출용)
             if not self.check_api_key():
                 return
-            
-            query = body.get("query", "")
-            session_id = body.get("session_id")
-            
-            # 오타 감지 (자동 보정하지 않고 제안)
-            fixed_query, typo_fixed = fix_typo(query, threshold=0.5)  # 한글 유사도 낮춤
-            typo_suggestion = None
-            if typo_fixed:
-                print(f"[오타 감지] '{query}' (추천: '{fixed_query}')")
-                typo_suggestion = fixed_query
-
-            # 세션 없으면 자동 생성
-            if not session_id:
-                session_id = str(uuid.uuid4())[:8]
-
-            # 캐시에 세션 확보 (없으면 DB에서 로드 시도)
-            sess = cache.get(session_id)
-            if not sess:
-                sess = cache.load_from_db(session_id)
-            if not sess:
-                sess = cache.ensure(session_id, title=query[:30])
-
-            # 유저 메시지를 캐시에 저장 (DB는 나중에 자동 flush)
-            cache.add_message(session_id, "user", query)
-
-            # 첫 메시지면 제목 업데이트
-            user_msgs = [m for m in sess["messages"] if m["role"] == "user"]
-            if len(user_msgs) == 1:
-                sess["title"] = query[:30] + ("..." if len(query) > 30 else "")
-
-            # 쿼리 정규화 (붙여쓰기 → 띄어쓰기 동의어)
-            QUERY_SYNONYMS = {
-                "엔더드래곤": "엔더 드래곤",
-                "엔더진주": "엔더 진주",
-                "엔더맨": "엔더맨",
-                "위더스켈레톤": "위더 스켈레톤",
-                "네더라이트": "네더라이트",
-                "레드스톤": "레드스톤",
-                "솔저76": "솔저: 76",
-                "정크랫": "정크랫",
-                # 동의어 확장 (검색 정확도 향상)
-                "체력": "생명력",
-                "공격력": "공격력",
-                "피통": "생명력",
-                "HP": "생명력",
-                "hp": "생명력",
-            }
-            search_query = query
-            for old, new in QUERY_SYNONYMS.items():
-                if old in search_query and old != new:
-                    search_query = search_query.replace(old, new)
-            # 쿼리 리라이트 (불용어 제거 + 게임명 확장)
-            search_query = rewrite_query(query, search_query)
-
-            # 게임명 감지
-            game_filter = None
-            query_lower = query.lower()
-            if any(kw in query_lower for kw in ["팰월드", "palworld", "팰"]):
-                game_filter = "palworld"
-            elif any(kw in query_lower for kw in ["오버워치", "overwatch", "옵치"]):
-                game_filter = "overwatch"
-            elif any(kw in query_lower for kw in ["마인크래프트", "마크", "minecraft"]):
-                game_filter = "minecraft"
-
-            # 게임 필터 없으면 캐시에서 이전 게임 컨텍스트 사용
-            if not game_filter and sess.get("game"):
-                game_filter = sess["game"]
-
-            # 후속 질문이면 이전 질문을 검색 쿼리에 합침 (캐시에서)
-            follow_up_markers = ["자세", "더", "그거", "그것", "알려", "뭐야", "어때"]
-            if session_id and len(query) < 20 and any(m in query for m in follow_up_markers):
-                if sess.get("last_query"):
-                    search_query = sess["last_query"] + " " + search_query
-
-            # ── DB 초기화 (lazy load) ──
-            # 주의: vdb는 멀티스텝 블록 이전에 초기화해야 함 (스코프 버그 방지)
-            # bm25_index / bm25_docs 도 get_db() 내부에서 global로 초기화됨
-            vdb = get_db()
-
-            # ── 멀티스텝 추론: 복합 질문 감지 (원본 query 사용) ──
-            is_complex, query_type, subqueries = detect_complex_query(query)
-            
-            if is_complex and len(subqueries) >= 2:
-                print(f"[멀티스텝] type={query_type}, subqueries={subqueries}", file=sys.stderr, flush=True)
-                
-                # 각 서브쿼리별 검색
-                subquery_results = []
-                for sq in subqueries[:3]:  # 최대 3개까지
-                    sq_intent = classify_intent(sq)
-                    sq_vec_w, sq_bm25_w = INTENT_WEIGHTS.get(sq_intent, (0.6, 0.4))
-
-                    # 서브쿼리별 게임 필터: 원본 쿼리에서 엔티티 직전에 등장한 가장 가까운 게임명 탐색
-                    # (다중 게임 쿼리 대응: "팰월드 람볼이랑 오버워치 리퍼" → 각각 분리)
-                    q_lower = query.lower()
-                    sq_pos = q_lower.find(sq.lower())
-                    sq_game_filter = None
-                    if sq_pos != -1:
-                        before = q_lower[:sq_pos]  # 엔티티 이전 텍스트
-                        _gmap = {
-                            "palworld":   ["팰월드", "palworld"],
-                            "overwatch":  ["오버워치", "overwatch", "옵치"],
-                            "minecraft":  ["마인크래프트", "마크", "minecraft"],
-                        }
-                        best_pos, best_game = -1, None
-                        for gname, kws in _gmap.items():
-                            for kw in kws:
-                                p = before.rfind(kw)  # 엔티티 앞에서 가장 가까운(오른쪽) 게임명
-                                if p > best_pos:
-                                    best_pos, best_game = p, gname
-                        sq_game_filter = best_game
-                    if not sq_game_filter:
-                        sq_game_filter = game_filter  # 감지 실패 시 전체 쿼리 필터 사용
-
-                    # 벡터 검색
-                    sq_vec = vdb.similarity_search(sq, k=10)
-                    if sq_game_filter:
-                        sq_vec = [d for d in sq_vec if d.metadata.get("game", "") == sq_game_filter]
-
-                    # BM25 검색
-                    sq_tokens = tokenize_ko(sq)
-                    sq_bm25_scores = bm25_index.get_scores(sq_tokens)
-                    sq_bm25_idx = sorted(range(len(sq_bm25_scores)), key=lambda i: sq_bm25_scores[i], reverse=True)[:10]
-                    sq_bm25_results = [bm25_docs[i] for i in sq_bm25_idx if sq_bm25_scores[i] > 0]
-                    if sq_game_filter:
-                        sq_bm25_results = [d for d in sq_bm25_results if d.metadata.get("game", "") == sq_game_filter]
-                    
-                    # RRF 통합
-                    sq_scores = {}
-                    for rank, doc in enumerate(sq_vec):
-                        doc_id = doc.page_content[:100]
-                        rrf = sq_vec_w / (RRF_K + rank + 1)
-                        sq_scores[doc_id] = (sq_scores.get(doc_id, (0, doc))[0] + rrf, doc)
-                    for rank, doc in enumerate(sq_bm25_results):
-                        doc_id = doc.page_content[:100]
-                        rrf = sq_bm25_w / (RRF_K + rank + 1)
-                        sq_scores[doc_id] = (sq_scores.get(doc_id, (0, doc))[0] + rrf, doc)
-                    
-                    # 제목 부스트
-                    for doc_id, (score, doc) in list(sq_scores.items()):
-                        title = doc.metadata.get("title", "").lower()
-                        title_clean = title.replace(" ", "").replace(":", "").replace("_", "").replace("/", "").replace("-", "")
-                        sq_clean = sq.lower().replace(" ", "")
-                        if sq_clean in title_clean or title_clean in sq_clean:
-                            sq_scores[doc_id] = (score + 10.0, doc)
-                    
-                    sq_ranked = sorted(sq_scores.values(), key=lambda x: x[0], reverse=True)
-                    sq_docs = [doc for _, doc in sq_ranked][:3]  # 서브쿼리당 3개
-                    
-                    # sources 수집
-                    sq_sources = []
-                    for doc in sq_docs:
-                        game = doc.metadata.get("game", "")
-                        title = doc.metadata.get("title", "")
-                        src = f"{game}/{title}"
-                        if src not in sq_sources:
-                            sq_sources.append(src)
-                    
-                    subquery_results.append((sq, sq_docs, sq_sources))
-                    print(f"  - {sq}: {len(sq_docs)}개 문서, sources={sq_sources}", file=sys.stderr, flush=True)
-                
-                # 결과 통합
-                context, sources = merge_results(subquery_results, query_type)
-                
-                # 멀티스텝 프롬프트
-                prompt = build_multi_step_prompt(query, context, query_type)
-                
-                payload = {
-                    "prompt": prompt,
-                    "n_predict": 300,  # 복합 질문이라 더 긴 답변
-                    "temperature": 0.01,
-                    "repeat_penalty": 1.2,
-                    "top_p": 0.9,
-                    "top_k": 30,
-                    # 멀티스텝: "[" 제거 (LLM이 [리퍼], [겐지] 헤더로 답변 시작 허용)
-                    # "\n\n\n" 사용 (비교 답변의 \n\n 단락 구분 허용)
-                    "stop": ["\n\n\n", "질문:", "참고:", "---", "```", "根据", "抱歉", "Sorry"],
-                }
-                try:
-                    resp = requests.post(LLAMA_URL, json=payload, timeout=90)
-                    resp.raise_for_status()
-                    result = resp.json()
-                    answer = result.get("content", "").strip() or "응답을 생성할 수 없습니다."
-                    answer = clean_answer(answer)
-                    
-                    # 멀티스텝 답변 검증
-                    is_valid, confidence, issues = validate_answer(answer, query, sources)
-                    print(f"🔍 [멀티스텝] 답변 검증: valid={is_valid}, confidence={confidence:.2f}, issues={issues}", file=sys.stderr, flush=True)
-                    
-                    if not is_valid and confidence < 0.3:
-                        answer = f"⚠️ 답변 신뢰도가 낮습니다 ({int(confidence*100)}%).\n\n{answer}"
-                except Exception as e:
-                    answer = f"LLM 오류: {e}"
-                
-                # 캐시에 저장
-                cache.add_message(session_id, "assistant", answer, sources=sources)
-                if game_filter:
-                    cache.set_game(session_id, game_filter)
-                cache.set_last_query(session_id, query)
-                
-                self._json({"answer": answer, "sources": sources, "session_id": session_id})
-                return
-            
-            # ── 의도 분류 ──
-            intent = classify_intent(search_query)
-
-            # ── 하이브리드 검색 + RRF (Reciprocal Rank Fusion) ──
-            vec_results = vdb.similarity_search(search_query, k=20)
-            # game_filter가 있으면 벡터 결과도 필터
-            if game_filter:
-                vec_filtered = [d for d in vec_results if d.metadata.get("game", "") == game_filter]
-                if vec_filtered:
-                    vec_results = vec_filtered
-            query_tokens = tokenize_ko(search_query)
-            bm25_scores = bm25_index.get_scores(query_tokens)
-            top_bm25_idx = sorted(range(len(bm25_scores)), key=lambda i: bm25_scores[i], reverse=True)[:20]
-            bm25_results = [bm25_docs[i] for i in top_bm25_idx if bm25_scores[i] > 0]
-            # game_filter가 있으면 BM25 결과도 필터
-            if game_filter:
-                bm25_results = [d for d in bm25_results if d.metadata.get("game", "") == game_filter]
-
-            # 의도별 가중치 적용
-            vec_w, bm25_w = INTENT_WEIGHTS.get(intent, (0.5, 0.5))
-
-            # RRF 점수 계산
-            doc_scores = {}  # doc_id → (score, doc)
-            for rank, doc in enumerate(vec_results):
-                doc_id = doc.page_content[:100]
-                rrf = vec_w / (RRF_K + rank + 1)
-                if doc_id in doc_scores:
-                    doc_scores[doc_id] = (doc_scores[doc_id][0] + rrf, doc)
-                else:
-                    doc_scores[doc_id] = (rrf, doc)
-            for rank, doc in enumerate(bm25_results):
-                doc_id = doc.page_content[:100]
-                rrf = bm25_w / (RRF_K + rank + 1)
-                if doc_id in doc_scores:
-                    doc_scores[doc_id] = (doc_scores[doc_id][0] + rrf, doc)
-                else:
-                    doc_scores[doc_id] = (rrf, doc)
-
-            # 제목 매칭 부스트 (검색어가 제목에 포함되면 대폭 증가)
-            for doc_id, (score, doc) in list(doc_scores.items()):
-                title = doc.metadata.get("title", "").lower()
-                # 공백/특수문자 제거 버전
-                title_clean = title.replace(" ", "").replace(":", "").replace("_", "").replace("/", "").replace("-", "")
-                query_clean = search_query.lower().replace(" ", "")
-                
-                # 키워드 분리
-                query_words = [w for w in search_query.split() if len(w) > 1]
-                
-                # 정확 매칭: 최고 점수
-                if query_clean in title_clean or title_clean in query_clean:
-                    doc_scores[doc_id] = (score + 15.0, doc)  # 강력한 부스트 (10→15)
-                # 다중 키워드 매칭 (2개 이상)
-                elif sum(1 for word in query_words if word in title_clean) >= 2:
-                    doc_scores[doc_id] = (score + 5.0, doc)  # 중간 부스트
-                # 부분 매칭: 보너스
-                elif any(word in title for word in query_words):
-                    doc_scores[doc_id] = (score + 2.0, doc)  # 작은 부스트
-            
-            # ── 검색 품질 평가 + 재검색 ──
-            ranked_initial = sorted(doc_scores.values(), key=lambda x: x[0], reverse=True)
-            quality_score = calculate_search_quality(ranked_initial[:10], search_query, {k: v[0] for k, v in doc_scores.items()})
-            print(f"📊 검색 품질: {quality_score:.3f}", file=sys.stderr, flush=True)
-            
-            # 품질이 낮으면 쿼리 확장 후 재검색
-            if should_retry_search(quality_score, threshold=0.15):
-                print(f"[재검색] 품질 낮음 ({quality_score:.3f}), 쿼리 확장", file=sys.stderr, flush=True)
-                expanded_query = expand_query_for_retry(search_query)
-                print(f"  확장: '{search_query}' → '{expanded_query}'", file=sys.stderr, flush=True)
-                
-                # 재검색
-                retry_vec = vdb.similarity_search(expanded_query, k=20)
-                if game_filter:
-                    retry_vec = [d for d in retry_vec if d.metadata.get("game", "") == game_filter]
-                retry_tokens = tokenize_ko(expanded_query)
-                retry_bm25_scores = bm25_index.get_scores(retry_tokens)
-                retry_bm25_idx = sorted(range(len(retry_bm25_scores)), key=lambda i: retry_bm25_scores[i], reverse=True)[:20]
-                retry_bm25_results = [bm25_docs[i] for i in retry_bm25_idx if retry_bm25_scores[i] > 0]
-                if game_filter:
-                    retry_bm25_results = [d for d in retry_bm25_results if d.metadata.get("game", "") == game_filter]
-                
-                # 재검색 RRF
-                retry_scores = {}
-                for rank, doc in enumerate(retry_vec):
-                    doc_id = doc.page_content[:100]
-                    rrf = vec_w / (RRF_K + rank + 1)
-                    retry_scores[doc_id] = (retry_scores.get(doc_id, (0, doc))[0] + rrf, doc)
-                for rank, doc in enumerate(retry_bm25_results):
-                    doc_id = doc.page_content[:100]
-                    rrf = bm25_w / (RRF_K + rank + 1)
-                    retry_scores[doc_id] = (retry_scores.get(doc_id, (0, doc))[0] + rrf, doc)
-                
-                # 재검색 품질 체크
-                retry_ranked = sorted(retry_scores.values(), key=lambda x: x[0], reverse=True)
-                retry_quality = calculate_search_quality(retry_ranked[:10], expanded_query, {k: v[0] for k, v in retry_scores.items()})
-                print(f"  재검색 품질: {retry_quality:.3f}", file=sys.stderr, flush=True)
-                
-                # 재검색이 더 좋으면 교체
-                if retry_quality > quality_score:
-                    doc_scores = retry_scores
-                    ranked_initial = retry_ranked
-                    print(f"  ✅ 재검색 채택 (품질 향상: {quality_score:.3f} → {retry_quality:.3f})", file=sys.stderr, flush=True)
-                else:
-                    print(f"  ⏭️ 원본 유지 (재검색 효과 없음)", file=sys.stderr, flush=True)
-            
-            # ── 제목 부스트 + 문맥 부스트 ──
-            for doc_id, (score, doc) in list(doc_scores.items()):
-                # 제목 부스트
-                title = doc.metadata.get("title", "").lower()
-                title_clean = title.replace(" ", "").replace(":", "").replace("_", "").replace("/", "").replace("-", "")
-                query_clean = search_query.lower().replace(" ", "")
-                query_words = [w for w in search_query.split() if len(w) > 1]
-                
-                if query_clean in title_clean or title_clean in query_clean:
-                    score += 15.0
-                elif sum(1 for word in query_words if word in title_clean) >= 2:
-                    score += 5.0
-                elif any(word in title for word in query_words):
-                    score += 2.0
-                
-                # 문맥 부스트
-                score = contextual_boost(doc, search_query, score)
-                
-                doc_scores[doc_id] = (score, doc)
-            
-            # RRF + 부스트 점수 기준 정렬
-            ranked = sorted(doc_scores.values(), key=lambda x: x[0], reverse=True)
-            results = [doc for _, doc in ranked]
-            print(f"🔍 intent={intent} vec_w={vec_w} bm25_w={bm25_w} | search_query='{search_query}' | top3: {[d.metadata.get('title','?')[:30] for d in results[:3]]}", file=sys.stderr, flush=True)
-
-            # 의도별 chunk 수 조절 (컨텍스트 압축)
-            # 너무 많은 문서를 넣으면 지연/품질 저하가 발생하므로 축소
-            if intent == "stat":
-                n_chunks = 3
-            elif intent in ("howto", "list", "compare"):
-                n_chunks = 4
-            else:
-                n_chunks = 4
-            if game_filter:
-                results = [d for d in results if d.metadata.get("game", "") == game_filter][:n_chunks]
-            else:
-                found_games = set()
-                for doc in results:
-                    g = doc.metadata.get("game", "")
-                    if g:
-                        found_games.add(g)
-                if len(found_games) >= 2:
-                    game_names = {"palworld": "팰월드", "overwatch": "오버워치", "minecraft": "마인크래프트"}
-                    game_list = [game_names.get(g, g) for g in sorted(found_games)]
-                    ask_msg = f"'{query}'은(는) 여러 게임에 존재합니다. 어떤 게임에 대해 알고 싶으신가요?"
-                    cache.add_message(session_id, "assistant", ask_msg)
-                    cache.set_last_query(session_id, query)
-                    self._json({"answer": ask_msg, "sources": [], "ask_game": True, "games": game_list, "session_id": session_id})
-                    return
-                results = results[:n_chunks]
-
-            context = ""
-            sources = []
-            for doc in results:
-                game = doc.metadata.get("game", "")
-                title = doc.metadata.get("title", "")
-                chunk = doc.page_content[:450]  # 컨텍스트 압축 (속도/정확도 균형)
-                context += f"\n[{title}]\n{chunk}\n"
-                src = f"{game}/{title}"
-                if src not in sources:
-                    sources.append(src)
-            ctx_preview = context.replace('\n', ' ')[:300]
-            print(f"📄 context ({len(context)}자): {ctx_preview}", file=sys.stderr, flush=True)
-
-            # 이전 대화 컨텍스트 (캐시에서, 현재 질문 제외)
-            recent = cache.get_history(session_id, limit=5)
-            history = ""
-            for msg in recent[:-1]:  # 현재 질문 제외
-                if msg["role"] == "user":
-                    history += f"사용자: {msg['content']}\n"
-                elif msg["role"] == "assistant":
-                    history += f"답변: {msg['content']}\n"
-
-            # LLM - 질문 형태 보정
-            llm_query = query
-            question_markers = ["?", "？", "뭐", "어떻게", "알려", "설명", "가르쳐", "어디", "언제", "누가", "왜"]
-            if not any(m in query for m in question_markers):
-                llm_query = f"{query}에 대해 알려줘"
-
-            system = SYSTEM_PROMPT.format(context=context)
-            if history:
-                prompt = f"{system}\n\n[이전 대화]\n{history}\n질문: {llm_query}\n\n답변:"
-            else:
-                prompt = f"{system}\n\n질문: {llm_query}\n\n답변:"
 
-            payload = {
-                "prompt": prompt,
-                "n_predict": 200,
-                "temperature": 0.01,
-                "repeat_penalty": 1.2,
-                "top_p": 0.9,
-                "top_k": 30,
-                "stop": ["\n\n", "질문:", "참고:", "---", "```", "[", "根据", "抱歉", "Sorry"],
-            }
+            trace = Trace("chat")
             try:
-                resp = requests.post(LLAMA_URL, json=payload, timeout=60)
-                resp.raise_for_status()
-                result = resp.json()
-                answer = result.get("content", "").strip() or "응답을 생성할 수 없습니다."
-                # 후처리: 중국어 제거, 반복 제거, 태그 제거
-                answer = clean_answer(answer)
-                
-                # ── 답변 검증 ──
-                is_valid, confidence, issues = validate_answer(answer, query, sources)
-                print(f"🔍 답변 검증: valid={is_valid}, confidence={confidence:.2f}, issues={issues}", file=sys.stderr, flush=True)
-                
-                if not is_valid and confidence < 0.3:
-                    # 신뢰도 매우 낮음 → 경고 추가
-                    answer = f"⚠️ 답변 신뢰도가 낮습니다 ({int(confidence*100)}%).\n\n{answer}"
-            except Exception as e:
-                answer = f"LLM 오류: {e}"
-
-            # 오타 제안 + 재검색 (검색 실패 시)
-            needs_retry = False
-            if typo_suggestion:
-                if not sources or len(sources) == 0:
-                    needs_retry = True
-                elif "참고자료에" in answer and ("없습니다" in answer or "찾을 수 없습니다" in answer):
-                    needs_retry = True
-            
-            if needs_retry:
-                print(f"[오타 재검색] '{query}' → '{typo_suggestion}'", file=sys.stderr, flush=True)
-                
-                # 보정된 쿼리로 재검색
-                retry_intent = classify_intent(typo_suggestion)
-                retry_vec = vdb.similarity_search(typo_suggestion, k=15)
-                retry_tokens = tokenize_ko(typo_suggestion)
-                retry_bm25_scores = bm25_index.get_scores(retry_tokens)
-                retry_bm25_idx = sorted(range(len(retry_bm25_scores)), key=lambda i: retry_bm25_scores[i], reverse=True)[:15]
-                retry_bm25_results = [bm25_docs[i] for i in retry_bm25_idx if retry_bm25_scores[i] > 0]
-                
-                # 재검색 RRF
-                retry_vec_w, retry_bm25_w = INTENT_WEIGHTS.get(retry_intent, (0.6, 0.4))
-                retry_scores = {}
-                for rank, doc in enumerate(retry_vec):
-                    doc_id = doc.page_content[:100]
-                    rrf = retry_vec_w / (RRF_K + rank + 1)
-                    retry_scores[doc_id] = retry_scores.get(doc_id, (0, doc))[0] + rrf, doc
-                for rank, doc in enumerate(retry_bm25_results):
-                    doc_id = doc.page_content[:100]
-                    rrf = retry_bm25_w / (RRF_K + rank + 1)
-                    retry_scores[doc_id] = retry_scores.get(doc_id, (0, doc))[0] + rrf, doc
-                
-                retry_ranked = sorted(retry_scores.values(), key=lambda x: x[0], reverse=True)
-                retry_results = [doc for _, doc in retry_ranked][:3]
-                
-                # 재검색 결과가 있으면
-                if retry_results and len(retry_results) > 0:
-                    retry_context = ""
-                    retry_sources = []
-                    for doc in retry_results:
-                        game = doc.metadata.get("game", "")
-                        title = doc.metadata.get("title", "")
-                        chunk = doc.page_content[:350]
-                        retry_context += f"\n[{title}]\n{chunk}\n"
-                        src = f"{game}/{title}"
-                        if src not in retry_sources:
-                            retry_sources.append(src)
-                    
-                    # 재검색 LLM 질의
-                    retry_system = SYSTEM_PROMPT.format(context=retry_context)
-                    retry_llm_query = f"{typo_suggestion}에 대해 알려줘"
-                    retry_prompt = f"{retry_system}\n\n질문: {retry_llm_query}\n\n답변:"
-                    retry_payload = {
-                        "prompt": retry_prompt,
-                        "n_predict": 200,
-                        "temperature": 0.01,
-                        "repeat_penalty": 1.2,
-                        "top_p": 0.9,
-                        "top_k": 30,
-                "stop": ["\n\n", "질문:", "참고:", "---", "```", "[", "根据", "抱歉", "Sorry"],
-                    }
-                    try:
-                        retry_resp = requests.post(LLAMA_URL, json=retry_payload, timeout=60)
-                        retry_resp.raise_for_status()
-                        retry_result = retry_resp.json()
-                        retry_answer = retry_result.get("content", "").strip() or "응답을 생성할 수 없습니다."
-                        retry_answer = clean_answer(retry_answer)
-                        print(f"[재검색 답변] '{retry_answer[:100]}'", file=sys.stderr, flush=True)
-                        
-                        # 재검색 성공 → 제안 메시지 + 재검색 결과
-                        answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n{retry_answer}"
-                        sources = retry_sources
-                        print(f"[재검색 성공] sources: {retry_sources}", file=sys.stderr, flush=True)
-                    except Exception as e:
-                        print(f"[재검색 LLM 오류] {e}", file=sys.stderr, flush=True)
-                        answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n" + answer
-                else:
-                    # 재검색도 실패
-                    answer = f"🔍 혹시 '**{typo_suggestion}**'를 찾으시나요?\n\n" + answer
-            
-            # 봇 메시지를 캐시에 저장 + 게임/쿼리 컨텍스트 업데이트
-            cache.add_message(session_id, "assistant", answer, sources=sources)
-            if game_filter:
-                cache.set_game(session_id, game_filter)
-            # last_query는 의미있는 질문만 저장 (후속 질문이면 유지)
-            if not (len(query) < 20 and any(m in query for m in follow_up_markers)):
-                cache.set_last_query(session_id, query)
-
-            self._json({"answer": answer, "sources": sources, "session_id": session_id})
+                with cache.pinned(chat_session_id(body)):
+                    self._chat(body, trace)
+            except BaseException as e:
+                # 처리 중 빠져나간 예외 — 기본값(llm)으로 집계되지 않도록
+                trace.outcome = "error"
+                trace.info.setdefault("error", repr(e))
+                raise
+            finally:
+                log_request(trace)
+
+        elif self.path == '/api/chat/stream':
+            if not self.check_api_key():
+                return
+            trace = Trace("stream")
+            try:
+                with cache.pinned(chat_session_id(body)):
+                    self._chat_stream(body, trace)
+            except BaseException as e:
+                # 처리 중 빠져나간 예외 — 기본값(llm)으로 집계되지 않도록
+                trace.outcome = "error"
+                trace.info.setdefault("error", repr(e))
+                raise
+            finally:
+                log_request(trace)
         else:
             self.send_response(404)
             self.end_headers()
 
+    def _chat(self, body, trace):
+        plan = prepare_chat(body, trace)
+        if "response" in plan:
+            self._json(plan["response"])
+            return
+
+        def generate(flight):
+            # LLM 대기열 입장은 실제로 생성하는 요청만 (캐시 hit/게임 선택/병합 대기는 503 없이 처리)
+            plan["deadline"] = time.monotonic() + plan["timeout"]  # 오타 재검색까지 포함한 요청 마감
+            with llm_gate.admit(plan["session_id"]) as ticket:
+                with trace.span("queue"):
+                    waited = ticket.wait(plan["timeout"])
+                payload = dict(plan["payload"], **llm_client.cache_params(ticket.slot))
+                try:
+                    # 대기한 만큼 LLM 타임아웃에서 차감 (요청 전체 마감 = plan["timeout"])
+                    with trace.span("llm"):
+                        result = llm_client.complete(LLAMA_URL, payload, timeout=plan["timeout"] - waited)
+                    raw_answer, error = result.get("content", ""), None
+                    trace.info["tokens"] = llm_client.token_counts(result)
+                except Exception as e:
+                    raw_answer, error = "", e
+            return finish_chat(plan, raw_answer, error)
+
+        # 같은 질문이 이미 생성 중이면 그 결과를 같이 받음, 세션 기록은 각자
+        try:
+            (answer, sources), shared = flights.do(plan["flight_key"], generate)
+        except Overloaded as e:
+            self._overloaded(e, plan, trace)
+            return
+        if shared:
+            print(f"🔗 요청 병합: '{plan['query']}' ({plan['session_id']})", file=sys.stderr, flush=True)
+            trace.outcome = "coalesced"
+        self._json(record_answer(plan, answer, sources))
+
+    def _chat_stream(self, body, trace):
+        """SSE 스트리밍 — sources 이벤트 → token 이벤트들 → done (정리/검증된 최종 답변)
+        대기열 거절은 스트림 시작 전이므로 일반 503 JSON 응답"""
+        plan = prepare_chat(body, trace)
+        if "response" in plan:
+            try:
+                self._start_sse()
+                self._sse("done", plan["response"])
+            except (BrokenPipeError, ConnectionResetError):
+                print(f"[스트림] 클라이언트 연결 끊김 ({plan['session_id']})", file=sys.stderr, flush=True)
+            return
+        client_gone = False
+
+        def send(flight, event, data):
+            """클라이언트로 SSE 전송 — 끊겼으면 병합 대기 중인 요청이 없을 때만 생성 중단 (Abandoned)
+            대기자가 있으면 답변은 끝까지 생성해서 대기자에게 넘김 (끊김이 flight 결과가 되지 않도록)"""
+            nonlocal client_gone
+            if not client_gone:
+                try:
+                    if event == "sources":
+                        self._start_sse()
+                    self._sse(event, data)
+                except (BrokenPipeError, ConnectionResetError):
+                    client_gone = True
+            if client_gone and not flight.waiters:
+                raise Abandoned("스트림 클라이언트 연결 끊김")
+
+        def generate(flight):
+            # LLM 대기열 입장은 실제로 생성하는 요청만 (Overloaded면 아직 헤더 전 → 503 가능)
+            plan["deadline"] = time.monotonic() + plan["timeout"]  # 오타 재검색까지 포함한 요청 마감
+            with llm_gate.admit(plan["session_id"]) as ticket:
+                with trace.span("queue"):
+                    waited = ticket.wait(plan["timeout"])
+                payload = dict(plan["payload"], **llm_client.cache_params(ticket.slot))
+                send(flight, "sources", {"sources": plan["sources"], "session_id": plan["session_id"]})
+                parts, error, final = [], None, {}
+                t0 = time.perf_counter()
+                try:
+                    for piece in stream_llm(payload, plan["timeout"] - waited, final):
+                        parts.append(piece)
+                        send(flight, "token", {"content": piece})
+                except Abandoned:
+                    raise
+                except Exception as e:
+                    error = e
+                trace.add("llm", (time.perf_counter() - t0) * 1000)
+            trace.info["tokens"] = llm_client.token_counts(final)
+            # 최종 프레임: 스트리밍된 원문 대신 clean_answer/validate_answer 적용본으로 교체
+            return finish_chat(plan, "".join(parts), error)
+
+        try:
+            (answer, sources), shared = flights.do(plan["flight_key"], generate)
+        except Overloaded as e:
+            self._overloaded(e, plan, trace)
+            return
+        except Abandoned:
+            print(f"[스트림] 클라이언트 연결 끊김 ({plan['session_id']})", file=sys.stderr, flush=True)
+            trace.outcome = "disconnected"
+            return
+        result = record_answer(plan, answer, sources)
+        try:
+            if shared:
+                # 병합된 요청은 토큰 없이 sources → done
+                print(f"🔗 요청 병합: '{plan['query']}' ({plan['session_id']})", file=sys.stderr, flush=True)
+                trace.outcome = "coalesced"
+                self._start_sse()
+                self._sse("sources", {"sources": sources, "session_id": plan["session_id"]})
+            if not client_gone:
+                self._sse("done", result)
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"[스트림] 클라이언트 연결 끊김 ({plan['session_id']})", file=sys.stderr, flush=True)
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+
+    def _overloaded(self, e, plan=None, trace=None):
+        """LLM 대기열 거절 → 503 + Retry-After
+        검색까지 끝난 요청(plan)은 세션에 안내 메시지를 남겨 유저 메시지만 덩그러니 남지 않도록"""
+        if trace is not None:
+            trace.outcome = "rejected"
+        print(f"🚦 LLM 대기열 거절: {e} (retry_after={e.retry_after}s, {llm_gate.stats()})", file=sys.stderr, flush=True)
+        data = {"error": "LLM server busy", "message": str(e), "retry_after": e.retry_after}
+        if plan is not None:
+            record_answer(plan, f"⏳ 요청이 많아 답변하지 못했습니다. {e.retry_after}초 후 다시 시도해주세요.", [])
+            data["session_id"] = plan["session_id"]
+        self._json(data, status=503, headers={"Retry-After": str(e.retry_after)})
+
+    def _sse(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+        self.wfile.flush()
+
+
     def do_DELETE(self):
         if self.path.startswith('/api/sessions/'):
             sid = self.path.split('/')[3]
-            conn = get_chat_conn()
-            conn.execute("DELETE FROM messages WHERE session_id=?", (sid,))
-            conn.execute("DELETE FROM sessions WHERE id=?", (sid,))
-            conn.commit()
-            conn.close()
+            cache.drop(sid)
+            chat_store.delete_session(sid)
             self._json({"ok": True})
         else:
             self.send_response(404)
             self.end_headers()
 
-    def _json(self, data):
-        self.send_response(200)
+    def _json(self, data, status=200, headers=None):
+        self.send_response(status)
         self.send_header("Content-Type", "application/json; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(json.dumps(data, ensure_ascii=False).encode())
 
+    def _json_etag(self, data, headers=None):
+        """ETag 붙인 JSON 응답 — If-None-Match가 같으면 본문 없이 304 (사이드바 폴링은 바뀐 게 없으면 헤더만)"""
+        headers = dict(headers or {})
+        body = json.dumps(data, ensure_ascii=False).encode()
+        headers["ETag"] = f'"{hashlib.sha1(body + headers.get("X-Next-Before", "").encode()).hexdigest()[:16]}"'
+        headers["Cache-Control"] = "no-cache"
+        if etag_matches(self.headers.get("If-None-Match"), headers["ETag"]):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, format, *args):
         pass
 
 
+class PooledHTTPServer(HTTPServer):
+    """고정 크기 워커 풀 HTTPServer — 느린 /api/chat 하나가 다른 요청을 막지 않도록
+    워커가 모두 바쁘면 accept 루프가 대기 (커널 backlog가 버퍼 역할, 스레드 무한 생성 X)"""
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-worker")
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except Exception:
+            self._slots.release()
+            self.shutdown_request(request)
+            raise
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
 def main():
-    print(f"🎮 게임위키 AI 서버 시작: http://localhost:{PORT}")
-    get_db()
-    HTTPServer(("", PORT), Handler).serve_forever()
+    print(f"🎮 게임위키 AI 서버 시작: http://localhost:{PORT} (워커 {MAX_WORKERS}개)")
+    print("📦 HTML " + ", ".join(f"{enc} {size // 1024}KB" for enc, size in PAGE.sizes().items()))
+    get_retriever()
+    PooledHTTPServer(("", PORT), Handler).serve_forever()
 
 if __name__ == "__main__":
     main()